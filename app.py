@@ -1,8 +1,15 @@
 import streamlit as st
 import pandas as pd
-from utils.data_loader import load_data
-from utils.search_engine import search_inventory
-from utils.ui_components import inject_custom_css, render_asset_card, render_results_table, render_sidebar_stats
+from utils.data_loader import SHEET_URLS, load_store, recent_movements, source_mask
+from utils.reconcile import index_lookup
+from utils.search_engine import search_positions, suggest_completions
+from utils.search_index import frame_version, mask_version
+from utils.service_client import SERVICE_URL, get_service_client
+from utils.telemetry import timed
+from utils.ui_components import inject_custom_css, render_asset_card, render_monitoring_panel, render_movements, render_reconciliation, render_results_table, render_suggestions, render_sidebar_stats
+
+# Only the most recent results keep their row positions in the session
+MAX_RESULT_HISTORY = 20
 
 # Page Config
 st.set_page_config(page_title="Trợ Lý Kho AI", page_icon="📦", layout="wide")
@@ -19,20 +26,21 @@ with st.sidebar:
     st.header("⚙️ Cấu hình")
     
     # Data Source Selection
-    source_option = st.radio("Nguồn dữ liệu", ["KHO NHÂN VIÊN", "KHO ĐƠN VỊ"], captions=["Dữ liệu công khai", "Dữ liệu nội bộ"])
-    
-    # URL Definitions
-    public_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQYR3SYVD4hk4BasVIySZs9RPfVr4ijl0q2B7TUIwxN5oPQ7EKDziLCqLc11juIe5Zs6b-iJhEg6gIk/pub?gid=1456104723&single=true&output=csv"
-    private_url = "https://docs.google.com/spreadsheets/d/e/2PACX-1vQYR3SYVD4hk4BasVIySZs9RPfVr4ijl0q2B7TUIwxN5oPQ7EKDziLCqLc11juIe5Zs6b-iJhEg6gIk/pub?gid=1050267960&single=true&output=csv"
+    source_option = st.radio("Nguồn dữ liệu", ["KHO NHÂN VIÊN", "KHO ĐƠN VỊ"], captions=["Dữ liệu công khai", "Dữ liệu nội bộ + công khai"])
+
+    # Mode Selection
+    mode = st.radio("Chế độ", ["💬 Tra cứu", "📋 Đối soát hàng loạt", "🔄 Biến động gần đây"],
+                    captions=["Hỏi đáp từng truy vấn", "Kiểm kê theo danh sách serial", "Thay đổi giữa các lần đồng bộ"])
     
-    selected_url = public_url
+    # Both sheets live in one store, access is a row mask over it
+    visible_sources = ["public"]
     is_authenticated = True
 
     if source_option == "KHO ĐƠN VỊ":
         password = st.text_input("🔒 Mật khẩu quản trị", type="password", placeholder="Nhập mật khẩu...")
         if password == "150590":
             st.success("Đã xác thực quyền truy cập")
-            selected_url = private_url
+            visible_sources = ["public", "private"]
             is_authenticated = True
         else:
             if password:
@@ -46,6 +54,7 @@ with st.sidebar:
     - **Tìm nhanh:** Nhập Serial (vd: `215...`)
     - **Tìm sản phẩm:** Nhập tên (vd: `Camera`)
     - **Tìm người:** Nhập tên nhân viên
+    - **Lọc nhiều điều kiện:** `tt:hỏng kho:"Gò Vấp"`, loại trừ bằng `-` (vd: `camera -nv:nhật`)
     """)
 
 # Initialize Chat History
@@ -56,31 +65,75 @@ if "messages" not in st.session_state:
 if is_authenticated:
     # Load Data
     with st.spinner("⏳ Đang đồng bộ dữ liệu..."):
-        df = load_data(selected_url, is_private=(source_option == "KHO ĐƠN VỊ"))
+        if SERVICE_URL:
+            # The search service holds the frame and the index, this app is one of its clients
+            client = get_service_client(SERVICE_URL, "all" if "private" in visible_sources else "public")
+            df = client.load_data()
+            search = client.search_positions
+            suggest = client.suggest_completions
+            lookup = client.serial_lookup
+            movements = client.recent_movements
+            allowed = None
+        else:
+            df = load_store()
+            search = search_positions
+            suggest = suggest_completions
+            lookup = index_lookup
+            movements = lambda: recent_movements(visible_sources)
+            allowed = None if set(SHEET_URLS) <= set(visible_sources) else source_mask(df, visible_sources)
+
+    if df.attrs.get("partial"):
+        # First load still streaming in: what is parsed so far is already searchable
+        st.info(f"⏳ Đang tải dữ liệu: đã có {len(df):,} dòng, kết quả có thể chưa đầy đủ.")
 
     if df.empty:
         st.error("⚠️ Không thể tải dữ liệu. Vui lòng kiểm tra kết nối internet.")
+    elif mode == "📋 Đối soát hàng loạt":
+        render_sidebar_stats(df, allowed)
+        render_reconciliation(df, allowed, lookup)
+    elif mode == "🔄 Biến động gần đây":
+        render_sidebar_stats(df, allowed)
+        render_movements(movements())
     else:
         # Show stats in sidebar
-        render_sidebar_stats(df)
+        render_sidebar_stats(df, allowed)
+        if source_option == "KHO ĐƠN VỊ":
+            render_monitoring_panel()
 
         # Display Chat History
-        for msg in st.session_state.messages:
+        version = frame_version(df)
+        scope = mask_version(allowed)
+        result_turns = [i for i, m in enumerate(st.session_state.messages) if m.get("positions") is not None]
+        latest_turn = result_turns[-1] if result_turns else None
+
+        for i, msg in enumerate(st.session_state.messages):
             role_icon = "👤" if msg["role"] == "user" else "🤖"
             with st.chat_message(msg["role"], avatar=role_icon):
                 st.markdown(msg["content"])
-                
-                # Render Results if they exist
-                if "results" in msg and msg["results"] is not None and not msg["results"].empty:
-                    results_df = msg["results"]
+
+                # History keeps row positions only; rows are materialized on demand
+                if msg.get("positions") is not None and len(msg["positions"]):
+                    if i != latest_turn and not st.toggle(f"📋 Xem lại {len(msg['positions']):,} kết quả", key=f"show_results_{i}"):
+                        continue
+                    positions = msg["positions"]
+                    if msg["version"] != version or msg.get("scope") != scope:
+                        # Data was refreshed or the visible sheets changed since: resolve the query again
+                        positions, _ = search(msg["query"], df, allowed)
+                        if msg["version"] != version:
+                            st.caption("🔄 Kết quả đã được cập nhật theo dữ liệu mới nhất.")
+                        else:
+                            st.caption("🔒 Kết quả đã được lọc theo nguồn dữ liệu đang xem.")
                     # If single result, show beautiful card
-                    if len(results_df) == 1:
-                        render_asset_card(results_df.iloc[0])
-                    else:
-                        render_results_table(results_df)
+                    if len(positions) == 1:
+                        render_asset_card(df.iloc[positions[0]])
+                    elif len(positions) > 1:
+                        render_results_table(df, positions, key=f"results_{i}")
+                elif msg.get("evicted"):
+                    st.caption("🗂️ Kết quả cũ đã được lược bỏ, hãy tìm lại nếu cần.")
 
-        # Chat Input
-        if prompt := st.chat_input("🔍 Nhập thông tin cần tra cứu..."):
+        # Chat Input (or a picked suggestion, one targeted query instead of trial and error)
+        picked = render_suggestions(df, suggest, allowed)
+        if prompt := st.chat_input("🔍 Nhập thông tin cần tra cứu...") or picked:
             # Display User Message
             st.session_state.messages.append({"role": "user", "content": prompt})
             with st.chat_message("user", avatar="👤"):
@@ -93,7 +146,7 @@ if is_authenticated:
                 greetings = ["xin chào", "hello", "hi", "chào", "ola"]
                 
                 response_text = ""
-                results_df = None
+                positions = None
                 
                 if any(g == clean_prompt for g in greetings):
                     response_text = "Chào bạn! Tôi là trợ lý kho AI. Bạn cần tìm kiếm thông tin thiết bị hay nhân viên nào không? 🚀"
@@ -101,25 +154,33 @@ if is_authenticated:
                 else:
                     with st.spinner("🔍 Đang tìm kiếm trong kho dữ liệu..."):
                         # Perform search
-                        results, message = search_inventory(prompt, df)
+                        positions, message = search(prompt, df, allowed)
                         
                         st.markdown(message)
                         response_text = message
                         
-                        if not results.empty:
-                            results_df = results
-                            if len(results) == 1:
-                                render_asset_card(results.iloc[0])
-                            else:
-                                render_results_table(results)
-
-            # Save to history
+                        with timed('render', rows=len(positions)):
+                            if len(positions) == 1:
+                                render_asset_card(df.iloc[positions[0]])
+                            elif len(positions) > 1:
+                                # Same key as this turn will have in the history, so paging state carries over
+                                render_results_table(df, positions, key=f"results_{len(st.session_state.messages)}")
+
+            # Save to history (row positions + dataset version, never the rows themselves)
             st.session_state.messages.append({
                 "role": "assistant", 
                 "content": response_text, 
-                "results": results_df
+                "query": prompt,
+                "positions": positions,
+                "version": frame_version(df),
+                "scope": mask_version(allowed),
             })
 
+            # Evict the oldest retained results
+            result_turns = [m for m in st.session_state.messages if m.get("positions") is not None]
+            for old_msg in result_turns[:-MAX_RESULT_HISTORY]:
+                old_msg["positions"] = None
+                old_msg["evicted"] = True
+
 else:
     st.warning("⛔ Khu vực hạn chế. Vui lòng xác thực ở thanh bên trái.")
-
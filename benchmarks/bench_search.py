@@ -0,0 +1,237 @@
+"""
+Offline benchmark of load_data's pipeline and search_inventory.
+
+    python -m benchmarks.bench_search --rows 10000 100000 1000000
+    python -m benchmarks.bench_search --rows 100000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_search --rows 100000 --compare benchmarks/baseline.json
+
+Every size gets a synthetic sheet (see benchmarks/synthetic.py), loaded through
+InventorySource like the app does. Reports the fetch / parse / clean / index
+times of that load (its trace record), frame memory, p50/p95/p99 latency for each
+kind of query, and per search tier its latency (from the query traces) and the
+build time of the index structures it reads. Caches are cleared before every
+query unless --warm is set.
+"""
+import argparse
+import json
+import logging
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.synthetic import write_sheet
+from utils.data_loader import InventorySource
+from utils.search_engine import _QUERY_CACHE, FUZZY_COLUMNS, UNIT_COLUMNS, search_inventory
+from utils.search_index import HAYSTACK_COLUMNS, SEARCH_COLUMNS, ColumnIndex, SerialIndex, fold_text
+from utils.telemetry import RingBufferSink, add_sink, remove_sink, summarize_queries
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+QUERIES_PER_KIND = 50
+# A kind is reported as a regression when its p95 grows past this ratio of the baseline
+DEFAULT_TOLERANCE = 1.25
+# Trace records kept per size: one per query, plus the load
+TRACE_BUFFER_SIZE = 100_000
+
+SERIAL_PARTS = ['Từ serial', 'serials']
+# Index structures each search tier reads: a column name is its ColumnIndex
+TIER_INDEX_PARTS = {
+    'serial_exact': SERIAL_PARTS,
+    'serial_range': SERIAL_PARTS,
+    'combined': HAYSTACK_COLUMNS + ['haystack'],
+    'product_name': ['Tên hàng hóa'],
+    'product_code': ['Mã hàng hóa'],
+    'employee': ['NHÂN VIÊN NHẬN'],
+    'unit': UNIT_COLUMNS,
+    'serial_prefix': SERIAL_PARTS,
+    'serial_contains': ['Từ serial'],
+    'fuzzy': list(FUZZY_COLUMNS),
+}
+
+
+def _percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3), 'n': len(samples_ms)}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _seconds(ms):
+    return round((ms or 0) / 1000, 3)
+
+
+def time_index_parts(df, index):
+    """Build time (s) of every structure of `index`, each rebuilt on its own."""
+    parts = {}
+    for col in SEARCH_COLUMNS:
+        if col in df.columns:
+            start = time.perf_counter()
+            ColumnIndex(df[col])
+            parts[col] = round(time.perf_counter() - start, 3)
+    if index.serials is not None:
+        start = time.perf_counter()
+        SerialIndex(index.columns['Từ serial'], df)
+        parts['serials'] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    index._build_haystack(np.arange(index.size))
+    parts['haystack'] = round(time.perf_counter() - start, 3)
+    return parts
+
+
+def build_query_mix(df, per_kind, seed=0):
+    """Representative queries drawn from the frame itself."""
+    rng = random.Random(seed)
+    serials = df['Từ serial'].astype(str).tolist()
+    products = df['Tên hàng hóa'].astype(str).unique().tolist()
+    employees = df['NHÂN VIÊN NHẬN'].astype(str).unique().tolist()
+    units = df['QUẬN/HUYỆN'].astype(str).unique().tolist()
+
+    def pick(values):
+        return [rng.choice(values) for _ in range(per_kind)]
+
+    return {
+        'exact_serial': pick(serials),
+        'serial_prefix': [s[:rng.randint(5, 8)] for s in pick(serials)],
+        'serial_infix': [s[3:9] for s in pick(serials)],
+        'product_name': [rng.choice(p.split()) for p in pick(products)],
+        'employee_name': [" ".join(e.split()[-2:]) for e in pick(employees)],
+        'employee_folded': [fold_text(e) for e in pick(employees)],
+        'unit': pick(units),
+        'multi_token': [f"{rng.choice(p.split())} {e.split()[-1]}" for p, e in zip(pick(products), pick(employees))],
+        'typo': [p[:3] + p[4:] for p in pick(products)],
+        'miss': [f"khongco{rng.randint(0, 10**6)}" for _ in range(per_kind)],
+    }
+
+
+def run_size(n_rows, per_kind, warm, workdir, seed=0):
+    """Benchmarks one sheet size, returns the report dict."""
+    path = Path(workdir) / f"sheet_{n_rows}_{seed}.csv"
+    if not path.exists():
+        write_sheet(path, n_rows, seed)
+
+    report = {'rows': n_rows}
+    sink = RingBufferSink(TRACE_BUFFER_SIZE)
+    add_sink(sink)
+    try:
+        # The app's load path: chunked parse and clean, index grown with the frame
+        source = InventorySource(str(path), snapshot_file='')
+        source._refresh()
+        df, index = source.df, source.index
+        load = sink.records('load')[-1]
+        for step in ('fetch', 'parse', 'clean'):
+            report[f'{step}_s'] = _seconds(load.get(f'{step}_ms'))
+        report['index_build_s'] = _seconds(load.get('index_ms'))
+
+        report['frame_mb'] = round(df.memory_usage(deep=True).sum() / 1e6, 1)
+        report['peak_rss_mb'] = _peak_rss_mb()
+
+        report['queries'] = {}
+        for kind, queries in build_query_mix(df, per_kind, seed).items():
+            samples = []
+            for query in queries:
+                if not warm:
+                    _QUERY_CACHE.clear()
+                    index._cache.clear()
+                start = time.perf_counter()
+                search_inventory(query, df)
+                samples.append((time.perf_counter() - start) * 1000)
+            report['queries'][kind] = _percentiles(samples)
+        tier_stats = summarize_queries(sink.records('query'))
+    finally:
+        remove_sink(sink)
+
+    report['index_parts'] = time_index_parts(df, index)
+    report['tiers'] = {}
+    for stats in tier_stats:
+        parts = TIER_INDEX_PARTS.get(stats['tier'], [])
+        build_s = sum(report['index_parts'].get(part, 0) for part in parts)
+        report['tiers'][stats.pop('tier')] = {**stats, 'index_build_s': round(build_s, 3) if parts else None}
+    return report
+
+
+def print_report(report):
+    print(f"\n== {report['rows']:,} rows ==")
+    print(f"fetch {report['fetch_s']}s | parse {report['parse_s']}s | clean {report['clean_s']}s"
+          f" | index build {report['index_build_s']}s | frame {report['frame_mb']} MB | peak RSS {report['peak_rss_mb']} MB")
+    print(f"{'query kind':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, stats in report['queries'].items():
+        print(f"{kind:<18}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    # '(tổng)' is the whole cascade of a query, the other rows one tier each
+    print(f"\n{'search tier':<18}{'runs':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'index s':>10}")
+    for tier, stats in report['tiers'].items():
+        build_s = '-' if stats['index_build_s'] is None else stats['index_build_s']
+        print(f"{tier:<18}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{build_s:>10}")
+
+
+def compare(reports, baseline, tolerance):
+    """Prints the ratio to the baseline p95 per kind, returns the regressions."""
+    regressions = []
+    by_rows = {str(r['rows']): r for r in baseline.get('results', [])}
+    for report in reports:
+        base = by_rows.get(str(report['rows']))
+        if base is None:
+            print(f"\n(no baseline for {report['rows']:,} rows)")
+            continue
+        print(f"\n== {report['rows']:,} rows vs baseline (p95) ==")
+        for kind, stats in report['queries'].items():
+            base_stats = base['queries'].get(kind)
+            if not base_stats:
+                continue
+            ratio = stats['p95_ms'] / max(base_stats['p95_ms'], 1e-3)
+            flag = "  <-- REGRESSION" if ratio > tolerance else ""
+            print(f"{kind:<18}{base_stats['p95_ms']:>10} -> {stats['p95_ms']:<10} x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append((report['rows'], kind, ratio))
+        for tier, stats in report.get('tiers', {}).items():
+            base_stats = base.get('tiers', {}).get(tier)
+            if not base_stats:
+                continue
+            ratio = stats['p95_ms'] / max(base_stats['p95_ms'], 1e-3)
+            print(f"{'tier ' + tier:<22}{base_stats['p95_ms']:>6} -> {stats['p95_ms']:<10} x{ratio:.2f}")
+        for key in ('index_build_s', 'clean_s'):
+            ratio = report[key] / max(base[key], 1e-3)
+            print(f"{key:<18}{base[key]:>10} -> {report[key]:<10} x{ratio:.2f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="serial rows per synthetic sheet")
+    parser.add_argument('--queries', type=int, default=QUERIES_PER_KIND, help="queries per kind")
+    parser.add_argument('--warm', action='store_true', help="keep the query/index caches between queries")
+    parser.add_argument('--workdir', default=Path(tempfile.gettempdir()) / 'tro-ly-kho-bench', help="where sheets are generated")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-baseline', metavar='PATH', help="write the results as a baseline JSON")
+    parser.add_argument('--compare', metavar='PATH', help="compare with a saved baseline, exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    # Streamlit warns about the missing script context in bare mode
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+    reports = []
+    for n_rows in args.rows:
+        report = run_size(n_rows, args.queries, args.warm, args.workdir, args.seed)
+        print_report(report)
+        reports.append(report)
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps({'results': reports}, indent=2, ensure_ascii=False), encoding='utf-8')
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        if compare(reports, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Synthetic inventory sheets with the same layout as the published Google Sheets export:
+one summary row per product/holder (the "merged cells" that load_data forward-fills),
+followed by its detail rows carrying 'Từ serial' / 'Đến serial'.
+"""
+import csv
+import random
+from pathlib import Path
+
+COLUMNS = ['STT', 'Mã hàng hóa', 'Tên hàng hóa', 'NHÂN VIÊN NHẬN', 'Trạng thái',
+           'QUẬN/HUYỆN', 'LOẠI KHO', 'Số lượng', 'Từ serial', 'Đến serial']
+
+FAMILY_NAMES = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương']
+MIDDLE_NAMES = ['Văn', 'Thị', 'Minh', 'Hữu', 'Quốc', 'Thanh', 'Ngọc', 'Đức', 'Hoàng', 'Thành']
+GIVEN_NAMES = ['An', 'Bình', 'Chi', 'Dũng', 'Giang', 'Hải', 'Hạnh', 'Hùng', 'Khoa', 'Linh', 'Long', 'Mai',
+               'Nam', 'Nhật', 'Phúc', 'Quân', 'Sơn', 'Tâm', 'Thảo', 'Trí', 'Tuấn', 'Việt', 'Yến']
+
+PRODUCTS = [
+    ('IP952', 'ATV_HISENSE_IP952'),
+    ('C6N', 'Camera Wifi Ezviz C6N'),
+    ('C3TN', 'Camera ngoài trời Ezviz C3TN'),
+    ('SW08', 'Switch 8 cổng TP-Link'),
+    ('SW24', 'Switch 24 cổng Cisco'),
+    ('ONT42X', 'Modem quang GPON ZTE F670 42x'),
+    ('ONT21', 'Modem quang Huawei HG8145'),
+    ('AP1200', 'Bộ phát Wifi Mesh Deco M4'),
+    ('STB4K', 'Đầu thu truyền hình 4K'),
+    ('PWR12', 'Bộ nguồn 12V 2A'),
+]
+
+DISTRICTS = ['Quận 1', 'Quận 3', 'Quận 7', 'Quận 10', 'Quận Gò Vấp', 'Quận Bình Thạnh', 'Quận Tân Bình',
+             'Thành phố Thủ Đức', 'Huyện Củ Chi', 'Huyện Bình Chánh', 'Huyện Nhà Bè', 'Huyện Cần Giờ']
+WAREHOUSES = ['Kho chính', 'Kho phụ', 'Kho kỹ thuật', 'Kho đơn vị']
+STATUSES = ['Mới', 'Mới', 'Mới', 'Đã dùng tốt', 'Hỏng', 'Bảo hành', 'Chờ sửa chữa', 'Thu hồi']
+
+SERIAL_STEMS = ['21', '215', 'ZTEG', 'HWTC', 'E6N', 'TPL']
+
+
+def employee_names(rng, count):
+    """Distinct Vietnamese full names (with diacritics)."""
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(FAMILY_NAMES)} {rng.choice(MIDDLE_NAMES)} {rng.choice(GIVEN_NAMES)}")
+    return sorted(names)
+
+
+def generate_rows(n_items, seed=0, range_share=0.02):
+    """
+    Yields raw sheet rows (lists in COLUMNS order) until `n_items` serial rows were produced.
+    A small share of detail rows describes a serial range ('Từ serial' < 'Đến serial').
+    """
+    rng = random.Random(seed)
+    employees = employee_names(rng, max(20, n_items // 400))
+    produced = 0
+    group = 0
+    serial_no = 0
+
+    while produced < n_items:
+        group += 1
+        code, name = rng.choice(PRODUCTS)
+        count = min(rng.randint(1, 40), n_items - produced)
+        # Summary row: the values every detail row below inherits
+        yield [group, code, name, rng.choice(employees), rng.choice(STATUSES),
+               rng.choice(DISTRICTS), rng.choice(WAREHOUSES), count, '', '']
+
+        stem = rng.choice(SERIAL_STEMS)
+        for _ in range(count):
+            serial_no += 1
+            number = f"{serial_no * 7919 % 10**10:010d}"
+            serial = f"{stem}{number}"
+            end = serial
+            if rng.random() < range_share:
+                end = f"{stem}{int(number) + rng.randint(1, 50):010d}"
+            yield ['', '', '', '', '', '', '', '', serial, end]
+            produced += 1
+
+
+def write_sheet(path, n_items, seed=0):
+    """Writes one synthetic export to `path` and returns it."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        # The real export pads some headers with spaces, load_data strips them
+        writer.writerow([f" {c}" if c == 'NHÂN VIÊN NHẬN' else c for c in COLUMNS])
+        writer.writerows(generate_rows(n_items, seed))
+    return path
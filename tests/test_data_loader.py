@@ -0,0 +1,237 @@
+"""
+InventorySource refreshes against a local HTTP server, and the indexes and
+chunked reads they rely on.
+
+    python -m pytest tests
+"""
+import hashlib
+import io
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.data_loader import (
+    SERIAL_COLUMNS, SERIAL_DTYPE, InventorySource, TEXT_COLUMNS, clean_inventory, concat_chunks, read_inventory_chunks,
+)
+import utils.search_index
+from utils.search_index import SearchIndex
+from utils.telemetry import RECENT
+
+HEADER = "STT,Mã hàng hóa,Tên hàng hóa, NHÂN VIÊN NHẬN,Trạng thái,QUẬN/HUYỆN,LOẠI KHO,Số lượng,Từ serial,Đến serial\n"
+PRODUCTS = [('CAM01', 'Camera Wifi Ezviz C6N'), ('SW08', 'Switch 8 cổng TP-Link'), ('ONT02', 'Modem quang ZTE F670')]
+HOLDERS = ['Võ Minh Nhật', 'Nguyễn Thị Hoa', 'Trần Đức Anh']
+STATUSES = ['Mới', 'Bảo hành', 'Hỏng']
+DISTRICTS = ['Quận 1', 'Gò Vấp', 'Thủ Đức']
+
+QUERIES = ['camera', 'vo minh', 'go vap', 'hong', 'zteg', 'f670 duc', 'khong co']
+COLUMN_QUERIES = [('Tên hàng hóa', 'camera'), ('NHÂN VIÊN NHẬN', 'hoa'), ('QUẬN/HUYỆN', 'thu duc'), ('Từ serial', '2150')]
+
+
+def export_groups(groups, start=0):
+    """Raw sheet rows, one block per group: a summary row, then one detail row per serial."""
+    blocks = []
+    for g in range(start, start + groups):
+        code, name = PRODUCTS[g % len(PRODUCTS)]
+        serials = [f"2150{g:04d}{i:02d}" for i in range(g % 4 + 1)]
+        lines = [f"{g + 1},{code},{name},{HOLDERS[g % 3]},{STATUSES[g % 3]},{DISTRICTS[g // 3 % 3]},Kho phụ,{len(serials)},,"]
+        lines.extend(f",,,,,,,,{serial},{serial}" for serial in serials)
+        if g % 5 == 0:
+            # A serial range listed on one row
+            lines.append(f",,,,,,,,ZTEG{g:04d}0000,ZTEG{g:04d}0099")
+        blocks.append("\n".join(lines) + "\n")
+    return blocks
+
+
+def make_export(groups, start=0):
+    return "".join(export_groups(groups, start))
+
+
+class SheetServer:
+    """Serves one CSV export over HTTP, with ETag/Last-Modified like the published sheet."""
+
+    def __init__(self, content, conditional=True):
+        self.content = content.encode('utf-8')
+        self.conditional = conditional
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                etag = '"%s"' % hashlib.md5(server.content).hexdigest()
+                if server.conditional and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv; charset=utf-8')
+                self.send_header('Content-Length', str(len(server.content)))
+                if server.conditional:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', formatdate(usegmt=True))
+                self.end_headers()
+                self.wfile.write(server.content)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/export.csv"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def sheet():
+    server = SheetServer(HEADER + make_export(40))
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def full_builds(monkeypatch):
+    """Sizes of the frames indexed from scratch while the test runs."""
+    builds = []
+    init = SearchIndex.__init__
+
+    def counting_init(self, df, *args, **kwargs):
+        builds.append(len(df))
+        init(self, df, *args, **kwargs)
+
+    monkeypatch.setattr(utils.search_index.SearchIndex, '__init__', counting_init)
+    return builds
+
+
+def refresh(source):
+    """Runs one refresh of `source` in the foreground, returns its load mode."""
+    source._refresh()
+    return [r for r in RECENT.records('load') if r['url'] == source.url][-1]['mode']
+
+
+def whole_clean(content):
+    """The export parsed and cleaned in one piece."""
+    columns = pd.read_csv(io.BytesIO(content), nrows=0).columns
+    df = pd.read_csv(io.BytesIO(content), dtype={col: str for col in columns if col.strip() in TEXT_COLUMNS})
+    return clean_inventory(df)[0]
+
+
+def assert_same_results(index, df):
+    """`index` answers every lookup like an index built from scratch for `df`."""
+    fresh = SearchIndex(df)
+    assert index.size == fresh.size
+    for query in QUERIES:
+        np.testing.assert_array_equal(index.match_all(query.split()), fresh.match_all(query.split()))
+    for col, fragment in COLUMN_QUERIES:
+        np.testing.assert_array_equal(index.contains(col, fragment), fresh.contains(col, fragment))
+        np.testing.assert_array_equal(index.equals(col, fragment), fresh.equals(col, fragment))
+    serials = df['Từ serial'].tolist()[::3] + ['ZTEG000000042', 'ZTEG00050050', 'khong-co']
+    for got, expected in zip(index.serial_lookup(serials), fresh.serial_lookup(serials)):
+        np.testing.assert_array_equal(got, expected)
+    np.testing.assert_array_equal(index.serial_prefix('21500'), fresh.serial_prefix('21500'))
+    expected_matches = fresh.fuzzy('camra wifi', ['Tên hàng hóa'])
+    assert expected_matches
+    for got, expected in zip(index.fuzzy('camra wifi', ['Tên hàng hóa']), expected_matches, strict=True):
+        assert got[:3] == expected[:3]
+        np.testing.assert_array_equal(got[3], expected[3])
+
+
+def test_first_load_is_full(sheet):
+    source = InventorySource(sheet.url, snapshot_file='')
+    assert refresh(source) == 'full'
+    assert len(source.df) == len(whole_clean(sheet.content))
+    assert source.index.version == source.df.attrs['version']
+    assert_same_results(source.index, source.df)
+
+
+def test_not_modified_keeps_frame(sheet):
+    source = InventorySource(sheet.url, snapshot_file='')
+    refresh(source)
+    df, index = source.df, source.index
+    assert refresh(source) == 'not_modified'
+    assert source.df is df and source.index is index
+    assert sheet.requests == 2
+
+
+def test_unchanged_content_skips_parsing(sheet):
+    sheet.conditional = False
+    source = InventorySource(sheet.url, snapshot_file='')
+    refresh(source)
+    df = source.df
+    assert refresh(source) == 'unchanged'
+    assert source.df is df
+
+
+def test_append_extends_frame_and_index(sheet, full_builds):
+    source = InventorySource(sheet.url, snapshot_file='')
+    refresh(source)
+    old = source.df
+    # Detail rows of the last group continue, then new groups follow
+    sheet.content += (",,,,,,,,2150003999,2150003999\n" + make_export(10, start=40)).encode('utf-8')
+    full_builds.clear()
+    assert refresh(source) == 'append'
+    assert full_builds == []
+
+    expected = whole_clean(sheet.content)
+    assert len(source.df) == len(expected)
+    assert source.df['NHÂN VIÊN NHẬN'].astype(str).tolist() == expected['NHÂN VIÊN NHẬN'].astype(str).tolist()
+    assert source.df['Từ serial'].tolist()[:len(old)] == old['Từ serial'].tolist()
+    assert_same_results(source.index, source.df)
+    events = source.changes.recent()
+    assert (events['Từ serial'] == '2150003999').any()
+
+
+def test_edit_updates_index_of_changed_rows(sheet, full_builds):
+    source = InventorySource(sheet.url, snapshot_file='')
+    refresh(source)
+    # One product handed to someone else, one group dropped: not an append
+    blocks = export_groups(40)
+    blocks[3] = blocks[3].replace(HOLDERS[0], HOLDERS[2])
+    del blocks[1]
+    sheet.content = (HEADER + "".join(blocks)).encode('utf-8')
+    full_builds.clear()
+    assert refresh(source) == 'full'
+    assert full_builds == []
+
+    expected = whole_clean(sheet.content)
+    assert source.df['Từ serial'].tolist() == expected['Từ serial'].tolist()
+    assert_same_results(source.index, source.df)
+    events = source.changes.recent()
+    assert set(events['Từ serial']) >= {'2150000100', '2150000101', '2150000300'}
+
+
+def test_append_after_snapshot_restore_keeps_serial_dtype(sheet, tmp_path):
+    snapshot = tmp_path / 'sheet.arrow'
+    refresh(InventorySource(sheet.url, snapshot_file=snapshot))
+
+    # A restarted process: the snapshot is served first, then the sheet grew
+    source = InventorySource(sheet.url, snapshot_file=snapshot)
+    assert source._restore_snapshot()
+    sheet.content += make_export(5, start=40).encode('utf-8')
+    assert refresh(source) == 'append'
+
+    for col in SERIAL_COLUMNS:
+        assert source.df[col].dtype == SERIAL_DTYPE, col
+    assert source.df['Từ serial'].tolist() == whole_clean(sheet.content)['Từ serial'].tolist()
+    assert_same_results(source.index, source.df)
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 7, 50])
+def test_chunked_read_matches_whole_file(chunk_rows):
+    content = (HEADER + make_export(60)).encode('utf-8')
+    pieces, rows = [], 0
+    for chunk_items, _, raw_rows in read_inventory_chunks(io.BytesIO(content), chunk_rows=chunk_rows):
+        pieces.append(chunk_items)
+        rows += raw_rows
+    chunked = concat_chunks(pieces)
+    expected = whole_clean(content)
+
+    assert rows == content.count(b'\n') - 1
+    assert chunked.index.tolist() == expected.index.tolist()
+    pd.testing.assert_frame_equal(chunked.astype(object), expected.astype(object))
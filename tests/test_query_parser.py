@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.query_parser import FIELD_ALIASES, SERIAL_FIELD, parse_query, run_query
+from utils.search_engine import search_positions
+from utils.search_index import HAYSTACK_COLUMNS, SearchIndex, fold_text, tag_frame
+from utils.telemetry import QueryTrace
+
+PRODUCTS = [('CAM01', 'Camera Wifi Ezviz C6N'), ('SW08', 'Switch 8 cổng TP-Link'), ('ONT02', 'Modem quang ZTE F670')]
+HOLDERS = ['Võ Minh Nhật', 'Nguyễn Thị Hoa', 'Trần Đức Anh', 'Lê Văn Nhã']
+STATUSES = ['Mới', 'Bảo hành', 'Hỏng']
+DISTRICTS = ['Quận 1', 'Gò Vấp', 'Thủ Đức']
+
+QUERIES = [
+    'tt:hong', 'Tt:Hỏng', 'kho:"go vap" camera', '-tt:moi', 'nv:nhat -"wifi ezviz"', '"switch 8"',
+    'camera -kho:"thu duc" tt:hong', '-tt:hong -nv:hoa', 'ma:cam sp:c6n', 'qh:"quan 1" -sp:modem',
+    'serial:2150*', 'sn:215000012*', 'serial:ZTEG00000042', 'serial:2150000101', '-serial:2150*',
+    'http://x.vn camera', 'tt:hong "khong co"',
+]
+
+
+def make_frame(rows=300):
+    i = np.arange(rows)
+    serials = [f"2150{n:06d}" for n in i]
+    ends = list(serials)
+    # A few rows list a serial range instead of one serial
+    for n in range(0, rows, 50):
+        serials[n], ends[n] = f"ZTEG{n:04d}0000", f"ZTEG{n:04d}0099"
+    return pd.DataFrame({
+        'Từ serial': serials,
+        'Đến serial': ends,
+        'Mã hàng hóa': pd.Categorical([PRODUCTS[n % 3][0] for n in i]),
+        'Tên hàng hóa': pd.Categorical([PRODUCTS[n % 3][1] for n in i]),
+        'NHÂN VIÊN NHẬN': pd.Categorical([HOLDERS[n % 4] for n in i]),
+        'Trạng thái': pd.Categorical([STATUSES[n % 7 % 3] for n in i]),
+        'QUẬN/HUYỆN': pd.Categorical([DISTRICTS[n // 5 % 3] for n in i]),
+        'LOẠI KHO': pd.Categorical(np.where(i % 2 == 0, 'Kho chính', 'Kho phụ')),
+    })
+
+
+def folded(df, col):
+    return df[col].astype(str).map(fold_text)
+
+
+def serial_hits(df, text):
+    """Brute-force serial filter: prefix, else exact, else a range covering it."""
+    serials = folded(df, 'Từ serial')
+    if text.endswith('*'):
+        return serials.str.startswith(fold_text(text.rstrip('*'))).to_numpy()
+    hits = (serials == fold_text(text)).to_numpy()
+    if hits.any():
+        return hits
+    match = re.fullmatch(r'(.*?)(\d+)', fold_text(text))
+    hits = np.zeros(len(df), dtype=bool)
+    for row, (start, end) in enumerate(zip(serials, folded(df, 'Đến serial'))):
+        low, high = re.fullmatch(r'(.*?)(\d+)', start), re.fullmatch(r'(.*?)(\d+)', end)
+        if match and low and high and low.group(1) == high.group(1) == match.group(1) \
+                and len(low.group(2)) == len(match.group(2)):
+            hits[row] = int(low.group(2)) <= int(match.group(2)) <= int(high.group(2))
+    return hits
+
+
+def expected_rows(df, query, allowed=None):
+    """Rows matching every term of `query`, checked value by value."""
+    mask = np.ones(len(df), dtype=bool) if allowed is None else allowed.copy()
+    for term in parse_query(query):
+        target = FIELD_ALIASES.get(term.field) if term.field else None
+        if target == SERIAL_FIELD:
+            hits = serial_hits(df, term.text)
+        else:
+            text = fold_text(term.text)
+            hits = np.zeros(len(df), dtype=bool)
+            for col in target or HAYSTACK_COLUMNS:
+                hits |= folded(df, col).str.contains(text, regex=False).to_numpy()
+        mask &= ~hits if term.negate else hits
+    return np.flatnonzero(mask)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('http://x.vn/a camera', [(None, 'http://x.vn/a', False, False), (None, 'camera', False, False)]),
+    ('a:b:c', [(None, 'a:b:c', False, False)]),
+    ('-', []),
+    ('camera -', [(None, 'camera', False, False)]),
+    ('- camera', [(None, 'camera', False, False)]),
+    ('""', []),
+    ('"wifi ezviz', [(None, 'wifi ezviz', False, True)]),
+    ('"wifi  ezviz" -"c6n"', [(None, 'wifi  ezviz', False, True), (None, 'c6n', True, True)]),
+    # A field needs its value right after the colon, otherwise both are free words
+    ('tt: x', [(None, 'tt:', False, False), (None, 'x', False, False)]),
+    ('Tt:Hỏng -KHO:"Gò Vấp"', [('tt', 'Hỏng', False, False), ('kho', 'Gò Vấp', True, True)]),
+    ('serial:215*', [('serial', '215*', False, False)]),
+])
+def test_parse_query(query, expected):
+    terms = parse_query(query)
+    assert [(t.field, t.text, t.negate, t.phrase) for t in terms] == expected
+
+
+@pytest.mark.parametrize('with_mask', [False, True])
+def test_run_query_matches_brute_force(with_mask):
+    df = make_frame()
+    index = SearchIndex(df)
+    allowed = np.arange(len(df)) * 7 % 5 != 2 if with_mask else None
+    for query in QUERIES:
+        positions = run_query(parse_query(query), index, QueryTrace(query, 'test'), allowed)
+        np.testing.assert_array_equal(positions, expected_rows(df, query, allowed), err_msg=query)
+
+
+def test_cached_phrases_keep_their_spacing():
+    df = tag_frame(pd.DataFrame({
+        'Từ serial': ['A1', 'A2', 'A3'],
+        'Tên hàng hóa': pd.Categorical(['Camera wifi  ezviz', 'Camera wifi ezviz', 'Switch']),
+    }), 'phrase-spacing')
+    assert search_positions('"wifi  ezviz"', df)[0].tolist() == [0]
+    assert search_positions('"wifi ezviz"', df)[0].tolist() == [1]
+    # Spacing between terms still shares one cache entry
+    assert search_positions('camera   "wifi ezviz"', df)[0].tolist() == [1]
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.reconcile import (
+    STATUS_MATCH, STATUS_MISSING, STATUS_OTHER_DISTRICT, STATUS_OTHER_HOLDER, read_scan_file, reconcile_serials,
+    summarize_report,
+)
+
+
+@pytest.fixture
+def inventory():
+    return pd.DataFrame({
+        'Từ serial': ['2150000100', '2150000101', 'ZTEG00010000', '2150000900', '2150000101'],
+        'Đến serial': ['2150000100', '2150000101', 'ZTEG00010099', '2150000900', '2150000101'],
+        'Tên hàng hóa': pd.Categorical(['Camera Wifi Ezviz C6N', 'Camera Wifi Ezviz C6N', 'Switch 8 cổng',
+                                        'Modem quang ZTE F670', 'Camera Wifi Ezviz C6N']),
+        'NHÂN VIÊN NHẬN': pd.Categorical(['Võ Minh Nhật', 'Võ Minh Nhật', 'Võ Minh Nhật', 'Trần Đức Anh', 'Nguyễn Thị Hoa']),
+        'QUẬN/HUYỆN': pd.Categorical(['Quận 1', 'Gò Vấp', 'Quận 1', 'Quận 1', 'Quận 1']),
+        'Nguồn': pd.Categorical(['KHO NHÂN VIÊN'] * 3 + ['KHO ĐƠN VỊ', 'KHO NHÂN VIÊN']),
+    })
+
+
+@pytest.mark.parametrize('name, data, expected', [
+    ('scan.csv', "STT,Số Serial,Ghi chú\n1,2150000100,ok\n2,2150000101,\n3,,trống\n", ['2150000100', '2150000101']),
+    ('scan.csv', "﻿TỪ SERIAL\n2150000100\n2150000100\nZTEG00010042\n", ['2150000100', 'ZTEG00010042']),
+    # No recognised header: the first column, header row included
+    ('scan.csv', "2150000100,Camera\n2150000101,Camera\n", ['2150000100', '2150000101']),
+    ('scan.txt', "2150000100\r\n2150000101;2150000100, ZTEG00010042\t", ['2150000100', '2150000101', 'ZTEG00010042']),
+    ('scan.csv', "", []),
+])
+def test_read_scan_file(name, data, expected):
+    assert read_scan_file(name, data.encode('utf-8')) == expected
+
+
+def test_found_missing_and_ranges(inventory):
+    report = reconcile_serials(['2150000100', 'khong-co', 'ZTEG00010042', '2150000101'], inventory)
+    assert report['Serial quét'].tolist() == ['2150000100', 'khong-co', 'ZTEG00010042', '2150000101', '2150000101']
+    assert report['Kết quả'].tolist() == [STATUS_MATCH, STATUS_MISSING, STATUS_MATCH, STATUS_MATCH, STATUS_MATCH]
+    # A serial inside a listed range is found on the range row
+    assert report['Tên hàng hóa'].tolist()[2] == 'Switch 8 cổng'
+    assert summarize_report(report) == {'scanned': 4, 'found': 3, 'missing': 1, 'other_holder': 0, 'other_district': 0}
+
+
+def test_holder_and_district_checks(inventory):
+    report = reconcile_serials(['2150000100', '2150000101', '2150000900'], inventory,
+                               holder='vo minh nhat', district='QUẬN 1')
+    assert report['Kết quả'].tolist() == [STATUS_MATCH, STATUS_OTHER_DISTRICT, STATUS_OTHER_HOLDER, STATUS_OTHER_HOLDER]
+    assert report['NHÂN VIÊN NHẬN'].tolist() == ['Võ Minh Nhật', 'Võ Minh Nhật', 'Nguyễn Thị Hoa', 'Trần Đức Anh']
+    assert summarize_report(report) == {'scanned': 3, 'found': 3, 'missing': 0, 'other_holder': 2, 'other_district': 1}
+
+
+def test_rows_outside_allowed_are_missing(inventory):
+    allowed = (inventory['Nguồn'] == 'KHO NHÂN VIÊN').to_numpy(copy=True)
+    allowed[4] = False
+    report = reconcile_serials(['2150000900', '2150000101'], inventory, allowed=allowed)
+    assert report['Kết quả'].tolist() == [STATUS_MISSING, STATUS_MATCH]
+    assert report['Nguồn'].tolist()[1] == 'KHO NHÂN VIÊN'
+    assert not report.isin(['Trần Đức Anh', 'Nguyễn Thị Hoa']).any().any()
+    assert summarize_report(report)['missing'] == 1
+
+
+def test_custom_lookup(inventory):
+    calls = []
+
+    def lookup(serials, df):
+        calls.append(list(serials))
+        return np.array([1], dtype=np.int64), np.array([3], dtype=np.int64)
+
+    report = reconcile_serials(['a', 'b'], inventory, lookup=lookup)
+    assert calls == [['a', 'b']]
+    assert report['Kết quả'].tolist() == [STATUS_MISSING, STATUS_MATCH]
+    assert report['Từ serial'].tolist()[1] == '2150000900'
@@ -0,0 +1,62 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import utils.search_index
+from utils.search_engine import search_positions
+from utils.search_index import PrefixIndex, SearchIndex, frame_version, tag_frame
+
+
+def make_frame(rows=5_000):
+    return pd.DataFrame({
+        'Từ serial': [f"ZTEG{i:08d}" for i in range(rows)],
+        'Tên hàng hóa': pd.Categorical(np.where(np.arange(rows) % 3 == 0, 'Camera Wifi Ezviz', 'Switch 8 cổng')),
+        'NHÂN VIÊN NHẬN': pd.Categorical(np.where(np.arange(rows) % 2 == 0, 'Võ Minh Nhật', 'Trần Đức Anh')),
+        'Trạng thái': pd.Categorical(np.where(np.arange(rows) % 5 == 0, 'Hỏng', 'Mới')),
+    })
+
+
+def test_slices_do_not_inherit_the_version():
+    df = tag_frame(make_frame(), 'tagged')
+    assert frame_version(df) == 'tagged'
+    for derived in (df[df['Trạng thái'] == 'Hỏng'], df.iloc[::2], df.copy(), df.iloc[::-1]):
+        assert derived.attrs['version'] == 'tagged'
+        assert frame_version(derived) != 'tagged'
+
+
+def test_search_on_a_slice_of_an_indexed_frame():
+    df = tag_frame(make_frame(), 'tagged-search')
+    search_positions('camera', df)
+    broken = df[df['Trạng thái'] == 'Hỏng']
+    positions, _ = search_positions('camera', broken)
+    expected, _ = search_positions('camera', broken.reset_index(drop=True))
+    np.testing.assert_array_equal(positions, expected)
+    assert (broken['Tên hàng hóa'].iloc[positions] == 'Camera Wifi Ezviz').all()
+    assert len(positions) == (broken['Tên hàng hóa'] == 'Camera Wifi Ezviz').sum()
+
+
+def test_prefix_build_does_not_block_lookups(monkeypatch):
+    index = SearchIndex(make_frame())
+    building, release = threading.Event(), threading.Event()
+    init = PrefixIndex.__init__
+
+    def slow_init(self, column):
+        building.set()
+        release.wait(10)
+        init(self, column)
+
+    monkeypatch.setattr(utils.search_index.PrefixIndex, '__init__', slow_init)
+    suggest = threading.Thread(target=index.suggest, args=('cam',))
+    suggest.start()
+    try:
+        assert building.wait(10)
+        # Cached lookups go through the index lock while the prefixes are being built
+        lookup = threading.Thread(target=index.contains, args=('Tên hàng hóa', 'camera'))
+        lookup.start()
+        lookup.join(2)
+        assert not lookup.is_alive()
+    finally:
+        release.set()
+        suggest.join()
+    assert index.suggest('cam')[0][1] == 'Camera Wifi Ezviz'
@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+import pytest
+
+import utils.snapshot
+from utils.search_service import MAX_BODY_BYTES, SearchService, ServiceError, _read_request, handle_request
+
+HEADER = "STT,Mã hàng hóa,Tên hàng hóa, NHÂN VIÊN NHẬN,Trạng thái,QUẬN/HUYỆN,LOẠI KHO,Số lượng,Từ serial,Đến serial\n"
+PUBLIC = HEADER + (
+    "1,CAM01,Camera Wifi Ezviz C6N,Võ Minh Nhật,Mới,Quận 1,Kho phụ,2,,\n"
+    ",,,,,,,,2150000100,2150000100\n"
+    ",,,,,,,,2150000101,2150000101\n"
+    "2,SW08,Switch 8 cổng TP-Link,Nguyễn Thị Hoa,Hỏng,Gò Vấp,Kho phụ,1,,\n"
+    ",,,,,,,,ZTEG00010000,ZTEG00010099\n"
+)
+PRIVATE = HEADER + (
+    "1,ONT02,Modem quang ZTE F670,Trần Đức Anh,Mới,Thủ Đức,Kho chính,1,,\n"
+    ",,,,,,,,2150000900,2150000900\n"
+)
+API_KEY = 'secret'
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.snapshot, 'SNAPSHOT_DIR', tmp_path / 'snapshots')
+    (tmp_path / 'public.csv').write_text(PUBLIC, encoding='utf-8')
+    (tmp_path / 'private.csv').write_text(PRIVATE, encoding='utf-8')
+    service = SearchService({'public': str(tmp_path / 'public.csv'), 'private': str(tmp_path / 'private.csv')},
+                            api_key=API_KEY)
+    service.warm_up()
+    return service
+
+
+def read_request(raw):
+    """Runs _read_request over `raw` bytes, as received from a client."""
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await _read_request(reader)
+    return asyncio.run(read())
+
+
+def request(service, method, target, body=b'', api_key=None):
+    """(status, JSON payload) of one request, errors answered like the server does."""
+    headers = {} if api_key is None else {'x-api-key': api_key}
+    try:
+        response = handle_request(service, method, target, headers, body)
+    except ServiceError as e:
+        return e.status, {'error': str(e)}
+    return response.status, json.loads(response.body)
+
+
+def test_read_request():
+    body = json.dumps({'serials': ['2150000100']}).encode('utf-8')
+    raw = (b"post /lookup?rows=0 HTTP/1.1\r\nHost: x\r\nX-Api-Key:  secret \r\n"
+           b"Content-Length: %d\r\n\r\n" % len(body)) + body
+    method, target, headers, got = read_request(raw)
+    assert (method, target, got) == ('POST', '/lookup?rows=0', body)
+    assert headers['x-api-key'] == 'secret'
+    assert read_request(b"") is None
+
+
+@pytest.mark.parametrize('raw, status', [
+    (b"GARBAGE\r\n\r\n", 400),
+    (b"GET /health HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+    (b"GET /health HTTP/1.1\r\nContent-Length: -5\r\n\r\n", 400),
+    (b"POST /lookup HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (MAX_BODY_BYTES + 1), 413),
+])
+def test_read_request_rejects(raw, status):
+    with pytest.raises(ServiceError) as error:
+        read_request(raw)
+    assert error.value.status == status
+
+
+def test_request_errors(service):
+    assert request(service, 'GET', '/nothing')[0] == 404
+    assert request(service, 'GET', '/lookup')[0] == 405
+    assert request(service, 'POST', '/search?q=camera')[0] == 405
+    assert request(service, 'POST', '/lookup', b'not json')[0] == 400
+    assert request(service, 'POST', '/lookup', b'["2150000100"]')[0] == 400
+    assert request(service, 'POST', '/lookup', b'{"serials": "2150000100"}')[0] == 400
+    assert request(service, 'GET', '/search?q=camera&limit=many')[0] == 400
+    assert request(service, 'GET', '/search?q=camera&source=nowhere')[0] == 404
+
+
+@pytest.mark.parametrize('source', ['private', 'all'])
+def test_protected_sources_need_the_key(service, source):
+    for api_key in (None, 'wrong', 'khóa bí mật'):
+        assert request(service, 'GET', f'/search?q=modem&source={source}', api_key=api_key)[0] == 403
+    status, payload = request(service, 'GET', f'/search?q=modem&source={source}', api_key=API_KEY)
+    assert status == 200 and payload['total'] == 1
+
+
+def test_lookup(service):
+    body = json.dumps({'serials': ['2150000101', 'ZTEG00010042', '2150000900']}).encode('utf-8')
+    status, payload = request(service, 'POST', '/lookup?rows=0', body)
+    assert status == 200
+    # The private serial does not exist for the public source
+    assert payload['found'] == 2 and payload['missing'] == ['2150000900']
+    assert all('rows' not in result for result in payload['results'])
+    positions = [result['positions'] for result in payload['results']]
+    assert positions[0] and positions[1] and not positions[2]
+
+    status, payload = request(service, 'POST', '/lookup', body)
+    assert status == 200
+    first = payload['results'][0]
+    assert [row['_position'] for row in first['rows']] == first['positions'] == positions[0]
+    assert {row['Từ serial'] for row in first['rows']} == {'2150000101'}
+    assert {row['Tên hàng hóa'] for row in payload['results'][1]['rows']} == {'Switch 8 cổng TP-Link'}
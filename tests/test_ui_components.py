@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from streamlit.dataframe_util import convert_pandas_df_to_arrow_bytes
+
+from utils.ui_components import PAGE_SIZE, compute_inventory_stats, shown_frame
+
+
+def make_frame(vocabulary, rows=5_000):
+    """A frame whose categoricals know `vocabulary` names, most of them unused by the first page."""
+    names = [f"Nhân viên {i:05d}" for i in range(vocabulary)]
+    return pd.DataFrame({
+        'Từ serial': [f"21500{i:06d}" for i in range(rows)],
+        'NHÂN VIÊN NHẬN': pd.Categorical(np.array(names)[np.arange(rows) % vocabulary], categories=names),
+        'QUẬN/HUYỆN': pd.Categorical(['Quận 1'] * rows, categories=['Quận 1', 'Quận 2']),
+    })
+
+
+def test_page_payload_does_not_grow_with_vocabulary():
+    small = make_frame(100).iloc[:PAGE_SIZE]
+    large = make_frame(5_000).iloc[:PAGE_SIZE]
+    assert len(convert_pandas_df_to_arrow_bytes(large)) > 4 * len(convert_pandas_df_to_arrow_bytes(small))
+    assert len(convert_pandas_df_to_arrow_bytes(shown_frame(large))) == len(convert_pandas_df_to_arrow_bytes(shown_frame(small)))
+
+
+def test_shown_frame_drops_categories_of_hidden_rows():
+    df = pd.DataFrame({
+        'NHÂN VIÊN NHẬN': pd.Categorical(['Võ Minh Nhật', 'Secret Person']),
+        'Nguồn': ['KHO NHÂN VIÊN', 'KHO ĐƠN VỊ'],
+    })
+    public = df.iloc[[0]]
+    assert b'Secret Person' in convert_pandas_df_to_arrow_bytes(public)
+    shown = shown_frame(public)
+    assert b'Secret Person' not in convert_pandas_df_to_arrow_bytes(shown)
+    assert shown['NHÂN VIÊN NHẬN'].tolist() == ['Võ Minh Nhật']
+
+
+def test_stats_list_only_visible_values():
+    df = make_frame(20, rows=40)
+    allowed = np.arange(len(df)) < 10
+    stats = compute_inventory_stats(df, 'test-stats', allowed, 'first-ten')
+    assert stats['total'] == 10
+    assert set(stats['holder'].index) == {f"Nhân viên {i:05d}" for i in range(10)}
+    assert list(stats['district'].index) == ['Quận 1']
+    assert not isinstance(stats['holder'].index, pd.CategoricalIndex)
@@ -0,0 +1,193 @@
+"""
+Keyed diff between two versions of an inventory frame, and the feed of the
+movements it finds (new stock, serials gone, holder / status / warehouse changes).
+
+Rows are keyed on 'Từ serial' (plus 'Nguồn' in a merged store, and an
+occurrence number when a serial is listed more than once). Keys and row
+contents are hashed with pandas' vectorized hashing, so matching two versions
+is one hash-table lookup per row and one uint64 comparison. Only the rows
+whose content hash changed are compared value by value. The hashes of the
+current version are kept for the next refresh, so each frame is hashed once.
+
+The same diff tells the search index which rows it can keep (see
+SearchIndex.updated), so the feed is a by-product of the refresh.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from utils.search_index import frame_version
+from utils.telemetry import emit
+
+# 'Nguồn' only exists in a merged store: the same serial may sit in both sheets
+KEY_COLUMNS = ['Nguồn', 'Từ serial']
+# Group number of the summary row: shifts whenever a group is inserted above
+IGNORED_COLUMNS = ['STT']
+
+EVENT_ADDED = "📦 Nhập mới"
+EVENT_REMOVED = "📤 Rời kho"
+EVENT_UPDATED = "✏️ Cập nhật"
+# A changed value in one of these columns is a movement of its own
+MOVEMENT_EVENTS = {
+    'NHÂN VIÊN NHẬN': "👤 Đổi người giữ",
+    'Trạng thái': "🔧 Đổi trạng thái",
+    'QUẬN/HUYỆN': "📍 Đổi khu vực",
+    'LOẠI KHO': "🏬 Đổi loại kho",
+}
+
+EVENT_COLUMNS = ['Thời điểm', 'Sự kiện', 'Từ serial', 'Tên hàng hóa', 'Trước', 'Sau', 'Nguồn']
+# Events kept in memory per tracked frame
+MAX_EVENTS = 5000
+
+
+def _combine(hashes):
+    # One uint64 per row out of several per-column hash arrays
+    return pd.util.hash_pandas_object(pd.DataFrame(dict(enumerate(hashes))), index=False).to_numpy()
+
+
+def fingerprint(df):
+    """(key hash, content hash) of every row, as two uint64 arrays."""
+    # Each column is hashed once, the key reuses the serial hash of the content
+    hashes = {col: pd.util.hash_pandas_object(df[col], index=False).to_numpy()
+              for col in df.columns if col not in IGNORED_COLUMNS}
+    keys = _combine([hashes[col] for col in KEY_COLUMNS if col in hashes])
+    # A serial listed twice is told apart by its occurrence number
+    occurrence = pd.Series(keys).groupby(keys).cumcount().to_numpy()
+    return _combine([keys, occurrence]), _combine(list(hashes.values()))
+
+
+def _values(df, col, rows):
+    if col not in df.columns:
+        return np.full(len(rows), None, dtype=object)
+    return df[col].iloc[rows].astype(object).to_numpy()
+
+
+def movement_events(old, new, added, removed, changed, changed_from):
+    """
+    Events of one refresh, one row per movement. `added` / `changed` are rows of
+    `new`, `removed` / `changed_from` rows of `old` (changed[i] was changed_from[i]).
+    """
+    parts = []
+
+    def part(df, rows, event, before, after):
+        parts.append(pd.DataFrame({
+            'Sự kiện': event,
+            'Từ serial': _values(df, 'Từ serial', rows),
+            'Tên hàng hóa': _values(df, 'Tên hàng hóa', rows),
+            'Trước': before,
+            'Sau': after,
+            'Nguồn': _values(df, 'Nguồn', rows),
+        }))
+
+    part(new, added, EVENT_ADDED, None, _values(new, 'NHÂN VIÊN NHẬN', added))
+    part(old, removed, EVENT_REMOVED, _values(old, 'NHÂN VIÊN NHẬN', removed), None)
+
+    moved = np.zeros(len(changed), dtype=bool)
+    for col, event in MOVEMENT_EVENTS.items():
+        before, after = _values(old, col, changed_from), _values(new, col, changed)
+        differs = ~(pd.isna(before) & pd.isna(after)) & (before != after)
+        moved |= differs
+        part(new, changed[differs], event, before[differs], after[differs])
+    # Changed somewhere else (quantity, 'Đến serial', product name...)
+    part(new, changed[~moved], EVENT_UPDATED, None, None)
+
+    events = pd.concat(parts, ignore_index=True)
+    events.insert(0, 'Thời điểm', pd.Timestamp.now().floor('s'))
+    return events[EVENT_COLUMNS]
+
+
+class ChangeTracker:
+    """
+    Diffs each new version of one frame against the previous one and keeps the
+    last `max_events` movements, newest first.
+    """
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.max_events = max_events
+        # (version, key hashes, content hashes) of the last tracked frame
+        self._fingerprint = None
+        self._events = deque()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def track(self, old, new, appended=False, record=True):
+        """
+        Fingerprints `new` and diffs it against `old`, its previous version (or None).
+        With `appended`, `new` is `old` plus rows at the end: only those are hashed.
+
+        Returns old_rows for SearchIndex.updated: old_rows[i] is the row of `old`
+        identical to row i of `new`, or -1. Returns None when the rows cannot be
+        matched (no previous version, different columns, duplicate keys).
+        Movements are recorded unless `record` is off or `old` is a partial frame.
+        """
+        with self._lock:
+            previous = self._fingerprint_of(old)
+            if appended and previous is not None:
+                keys, content = fingerprint(new.iloc[len(old):])
+                if pd.Index(previous[0]).get_indexer(keys).max(initial=-1) >= 0:
+                    # A serial of the new rows was already listed: occurrences must be renumbered
+                    keys, content = fingerprint(new)
+                else:
+                    keys, content = np.concatenate([previous[0], keys]), np.concatenate([previous[1], content])
+            else:
+                keys, content = fingerprint(new)
+            self._fingerprint = (frame_version(new), keys, content)
+
+        if previous is None or list(old.columns) != list(new.columns):
+            return None
+        old_keys, old_content = previous
+        lookup = pd.Index(old_keys)
+        if not lookup.is_unique or not pd.Index(keys).is_unique:
+            return None
+
+        at = lookup.get_indexer(keys)
+        matched = np.flatnonzero(at >= 0)
+        same = np.zeros(len(keys), dtype=bool)
+        same[matched] = old_content[at[matched]] == content[matched]
+        old_rows = np.where(same, at, -1)
+
+        if record and not old.attrs.get('partial'):
+            seen = np.zeros(len(old_keys), dtype=bool)
+            seen[at[matched]] = True
+            changed = matched[~same[matched]]
+            events = movement_events(old, new, np.flatnonzero(at < 0), np.flatnonzero(~seen), changed, at[changed])
+            self._record(events)
+            emit({
+                'kind': 'changes',
+                'version': frame_version(new),
+                'added': int((at < 0).sum()),
+                'removed': int((~seen).sum()),
+                'changed': len(changed),
+                'events': len(events),
+            })
+        return old_rows
+
+    def _fingerprint_of(self, df):
+        if df is None or df.empty:
+            return None
+        if self._fingerprint is not None and self._fingerprint[0] == frame_version(df):
+            return self._fingerprint[1:]
+        # Not tracked yet (e.g. restored from a snapshot): hashed once here
+        return fingerprint(df)
+
+    def _record(self, events):
+        if events.empty:
+            return
+        with self._lock:
+            self._events.append(events.head(self.max_events))
+            self._count += min(len(events), self.max_events)
+            while self._count - len(self._events[0]) >= self.max_events:
+                self._count -= len(self._events.popleft())
+
+    def recent(self, limit=None, sources=None):
+        """The last movements, newest first. `sources` keeps only these 'Nguồn' labels."""
+        with self._lock:
+            parts = list(self._events)[::-1]
+        if not parts:
+            return pd.DataFrame(columns=EVENT_COLUMNS)
+        events = pd.concat(parts, ignore_index=True)
+        if sources is not None:
+            events = events[events['Nguồn'].isna() | events['Nguồn'].isin(sources)]
+        return events.head(limit) if limit else events
@@ -1,44 +1,552 @@
+import contextlib
+import hashlib
+import io
+import logging
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+import numpy as np
 import pandas as pd
 import streamlit as st
+from pandas.api.types import union_categoricals
+from utils.changes import ChangeTracker
+from utils.search_index import frame_version, get_search_index, register_search_index, tag_frame
+from utils.snapshot import load_snapshot, save_snapshot, snapshot_path
+from utils.telemetry import LoadTrace
 
-@st.cache_data(ttl=600)  # Cache data for 10 minutes
-def load_data(url, is_private=False):
-    try:
-        # Read CSV from URL
-        df = pd.read_csv(url)
-        
-        # 0. Clean Column Names (Strip whitespace)
-        df.columns = df.columns.str.strip()
-        
-        # 1. Forward Fill (Handle merged cells)
-        # This is CRITICAL for both private and public sheets with this structure
-        # We forward fill key info from the "Summary Row" down to the "Detail Rows"
-        cols_to_ffill = ['STT', 'Mã hàng hóa', 'Tên hàng hóa', 'NHÂN VIÊN NHẬN', 'Trạng thái', 'QUẬN/HUYỆN', 'LOẠI KHO']
-        
-        # Only ffill columns that actually exist
-        existing_cols = [c for c in cols_to_ffill if c in df.columns]
-        if existing_cols:
-            df[existing_cols] = df[existing_cols].ffill()
-
-        # 2. Filter for Rows with Serial Numbers
-        # The actual items are in rows where "Từ serial" is present
-        if 'Từ serial' in df.columns:
-            # First, drop rows where Serial is NaN
-            df_items = df.dropna(subset=['Từ serial']).copy()
-            
-            # Clean up empty strings if any
-            df_items['Từ serial'] = df_items['Từ serial'].astype(str).str.strip()
-            df_items = df_items[df_items['Từ serial'] != '']
-            
-            # Additional cleanup for display
-            if 'NHÂN VIÊN NHẬN' in df_items.columns:
-                df_items['NHÂN VIÊN NHẬN'] = df_items['NHÂN VIÊN NHẬN'].astype(str).str.strip()
-                
-            return df_items
-            
+logger = logging.getLogger(__name__)
+
+# Published exports of the two inventories, by source name
+SHEET_URLS = {
+    'public': "https://docs.google.com/spreadsheets/d/e/2PACX-1vQYR3SYVD4hk4BasVIySZs9RPfVr4ijl0q2B7TUIwxN5oPQ7EKDziLCqLc11juIe5Zs6b-iJhEg6gIk/pub?gid=1456104723&single=true&output=csv",
+    'private': "https://docs.google.com/spreadsheets/d/e/2PACX-1vQYR3SYVD4hk4BasVIySZs9RPfVr4ijl0q2B7TUIwxN5oPQ7EKDziLCqLc11juIe5Zs6b-iJhEg6gIk/pub?gid=1050267960&single=true&output=csv",
+}
+
+# Name of each source in the merged store, shown in SOURCE_COLUMN
+SOURCE_LABELS = {'public': "KHO NHÂN VIÊN", 'private': "KHO ĐƠN VỊ"}
+SOURCE_COLUMN = 'Nguồn'
+
+REFRESH_INTERVAL = 600  # Refresh data every 10 minutes
+FETCH_TIMEOUT = 60
+
+# Key info copied from the "Summary Row" down to the "Detail Rows"
+FFILL_COLUMNS = ['STT', 'Mã hàng hóa', 'Tên hàng hóa', 'NHÂN VIÊN NHẬN', 'Trạng thái', 'QUẬN/HUYỆN', 'LOẠI KHO']
+
+# Read as text when parsing (the rest is left to type inference)
+TEXT_COLUMNS = ['Mã hàng hóa', 'Tên hàng hóa', 'NHÂN VIÊN NHẬN', 'Trạng thái', 'QUẬN/HUYỆN', 'LOẠI KHO', 'Từ serial', 'Đến serial']
+# Raw lines parsed per chunk
+CHUNK_ROWS = 50_000
+
+# Repeated on every detail row after ffill: stored once per distinct value
+CATEGORY_COLUMNS = ['Tên hàng hóa', 'Mã hàng hóa', 'NHÂN VIÊN NHẬN', 'Trạng thái', 'QUẬN/HUYỆN', 'LOẠI KHO']
+# Unique per row, kept as compact strings instead
+SERIAL_COLUMNS = ['Từ serial', 'Đến serial']
+
+# Sheets of a store are fetched concurrently
+_FETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sheet-fetch')
+
+try:
+    import pyarrow  # noqa: F401
+    SERIAL_DTYPE = 'string[pyarrow]'
+except ImportError:
+    SERIAL_DTYPE = 'string'
+
+
+def compact_inventory(df):
+    """
+    Stores the repeated text columns as categoricals and the serial columns as a compact string dtype.
+    Columns already in that form are left untouched, so it is cheap to re-apply.
+    """
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in SERIAL_COLUMNS:
+        # Any other string dtype too: concatenating two of them falls back to object
+        if col in df.columns and df[col].dtype != SERIAL_DTYPE:
+            df[col] = df[col].astype(SERIAL_DTYPE)
+    return df
+
+
+def concat_inventory(head, tail):
+    """Appends cleaned rows, keeping the categoricals of `head` (new values become new categories)."""
+    tail = tail.copy()
+    for col in CATEGORY_COLUMNS:
+        if col in head.columns and isinstance(head[col].dtype, pd.CategoricalDtype) and col in tail.columns:
+            known = head[col].cat.categories
+            tail_values = tail[col].dropna().unique()
+            added = pd.Index(tail_values).difference(known)
+            if len(added):
+                # Appending categories keeps the existing codes valid
+                head = head.assign(**{col: head[col].cat.add_categories(added)})
+            tail[col] = pd.Categorical(tail[col], dtype=head[col].dtype)
+    return compact_inventory(pd.concat([head, tail]))
+
+
+def concat_chunks(pieces):
+    """Concatenates cleaned frames, with the union of their categories (not object columns)."""
+    pieces = [piece for piece in pieces if not piece.empty] or list(pieces[:1])
+    if len(pieces) == 1:
+        return pieces[0]
+    merged = pd.concat(pieces)
+    for col in CATEGORY_COLUMNS:
+        parts = [piece[col] for piece in pieces if col in piece.columns]
+        if len(parts) == len(pieces) and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            merged[col] = union_categoricals(parts, ignore_order=True)
+    return compact_inventory(merged)
+
+
+def read_inventory_chunks(source, ffill_state=None, row_offset=0, trace=None, chunk_rows=CHUNK_ROWS):
+    """
+    Parses and cleans a raw export (file-like) `chunk_rows` lines at a time.
+    The ffill state is carried from chunk to chunk, so a summary row at the end
+    of one chunk still fills the detail rows starting the next.
+    Yields (cleaned chunk, ffill_state after it, raw rows in it).
+    """
+    # Text columns are read as text up front: no type guessing per chunk, no astype(str) copies
+    columns = pd.read_csv(source, nrows=0).columns
+    source.seek(0)
+    dtype = {col: str for col in columns if col.strip() in TEXT_COLUMNS}
+
+    reader = pd.read_csv(source, chunksize=chunk_rows, dtype=dtype)
+    step = trace.step if trace is not None else (lambda name: contextlib.nullcontext())
+    while True:
+        with step('parse'):
+            chunk = next(reader, None)
+        if chunk is None:
+            return
+        # Row labels stay the raw line numbers of the whole export
+        chunk.index = chunk.index + row_offset
+        with step('clean'):
+            chunk_items, ffill_state = clean_inventory(chunk, ffill_state)
+        yield chunk_items, ffill_state, len(chunk)
+
+
+def clean_inventory(df, ffill_state=None):
+    """
+    Cleans one raw sheet export (or an appended block of it).
+    `ffill_state` carries the last summary-row values from the rows above the block.
+    Returns (df_items, ffill_state for the next block).
+    """
+    # 0. Clean Column Names (Strip whitespace)
+    df.columns = df.columns.str.strip()
+
+    # 1. Forward Fill (Handle merged cells)
+    # This is CRITICAL for both private and public sheets with this structure
+    # We forward fill key info from the "Summary Row" down to the "Detail Rows"
+    # Only ffill columns that actually exist
+    existing_cols = [c for c in FFILL_COLUMNS if c in df.columns]
+    if existing_cols:
+        df[existing_cols] = df[existing_cols].ffill()
+        if ffill_state:
+            # Leading detail rows of an appended block belong to the summary row above it
+            df[existing_cols] = df[existing_cols].fillna(value=ffill_state)
+        if not df.empty:
+            ffill_state = {c: v for c, v in df[existing_cols].iloc[-1].items() if pd.notna(v)}
+
+    # 2. Filter for Rows with Serial Numbers
+    # The actual items are in rows where "Từ serial" is present
+    if 'Từ serial' in df.columns:
+        # First, drop rows where Serial is NaN
+        df_items = df.dropna(subset=['Từ serial']).copy()
+
+        # Clean up empty strings if any
+        df_items['Từ serial'] = df_items['Từ serial'].astype(str).str.strip()
+        df_items = df_items[df_items['Từ serial'] != '']
+
+        # Additional cleanup for display
+        if 'NHÂN VIÊN NHẬN' in df_items.columns:
+            df_items['NHÂN VIÊN NHẬN'] = df_items['NHÂN VIÊN NHẬN'].astype(str).str.strip()
+
+        return compact_inventory(df_items), ffill_state
+
+    return df, ffill_state
+
+
+class InventorySource:
+    """
+    Keeps one published sheet in memory and refreshes it stale-while-revalidate:
+    once the data is older than `refresh_interval`, callers get the current frame
+    right away while a background thread re-downloads it.
+
+    A refresh sends ETag/Last-Modified conditional headers, skips parsing when
+    the content hash did not change, and when rows were only appended, cleans
+    and indexes just the new block.
+
+    Every new version is also written to a local columnar snapshot. After a
+    restart (or in another server process) the snapshot is memory-mapped and
+    served at once, and the network refresh runs in the background.
+
+    Every refresh is also diffed against the previous frame by serial (see
+    utils.changes): the movements are kept in `changes`, and when rows were not
+    only appended, the index is updated for the changed rows only.
+    """
+
+    def __init__(self, url, refresh_interval=REFRESH_INTERVAL, snapshot_file=None, build_index=True):
+        self.url = url
+        # Off when the frame is only read through a merged InventoryStore (which tracks changes itself)
+        self.build_index = build_index
+        self.changes = ChangeTracker() if build_index else None
+        self.refresh_interval = refresh_interval
+        self.snapshot_file = snapshot_path(url) if snapshot_file is None else snapshot_file
+        self.df = None
+        # Index of self.df, kept here so the next refresh can extend or update it
+        self.index = None
+        self.loaded_at = 0.0
+        self.last_error = None
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        self._content_length = 0
+        self._header = b''
+        self._raw_rows = 0
+        self._ffill_state = None
+        self._refreshing = False
+        self._published = threading.Event()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the current frame. Only the very first load blocks the caller, and
+        only until its first chunk is parsed: that frame has attrs['partial'] set
+        and grows on the next calls until the whole export is in.
+        """
+        with self._lock:
+            first_load = self.df is None and not self._restore_snapshot()
+            if (first_load or time.time() - self.loaded_at > self.refresh_interval) and not self._refreshing:
+                self._refreshing = True
+                self._published.clear()
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        if first_load:
+            self._published.wait()
+            if self.df is None:
+                raise self.last_error
+        return self.df
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            # Keep serving the stale frame, try again after the next interval
+            self.last_error = e
+            self.loaded_at = time.time()
+            logger.warning("Background refresh of %s failed: %s", self.url, e)
+        finally:
+            self._refreshing = False
+            self._published.set()
+
+    def _publish(self, df, index=None):
+        self.df, self.index = df, index
+        self._published.set()
+
+    def _fetch(self):
+        """Returns the new content, or None when the server says it did not change."""
+        if not self.url.startswith(('http://', 'https://')):
+            # Local export (offline runs, benchmarks)
+            with open(self.url, 'rb') as f:
+                return f.read()
+
+        request = urllib.request.Request(self.url)
+        if self._etag:
+            request.add_header('If-None-Match', self._etag)
+        if self._last_modified:
+            request.add_header('If-Modified-Since', self._last_modified)
+        try:
+            with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+                content = response.read()
+                self._etag = response.headers.get('ETag')
+                self._last_modified = response.headers.get('Last-Modified')
+                return content
+        except HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+
+    def _refresh(self):
+        trace = LoadTrace(self.url)
+        with trace.step('fetch'):
+            content = self._fetch()
+        self.loaded_at = time.time()
+        if content is None:
+            trace.finish('not_modified')
+            return
+
+        digest = hashlib.blake2b(content, digest_size=8).hexdigest()
+        if digest == self._digest:
+            # Same bytes: keep the parsed frame and its index
+            trace.finish('unchanged')
+            return
+
+        appended = self.df is not None and self._is_append(content)
+        if appended:
+            df_items = self._load_appended(content, trace)
+            tag_frame(df_items, digest)
+            index = None
+            if self.build_index:
+                with trace.step('diff'):
+                    self.changes.track(self.df, df_items, appended=True)
+                # Appended rows only: extend the previous index instead of rebuilding it
+                with trace.step('index'):
+                    index = self.index.extended(df_items)
+                    register_search_index(index)
         else:
-            return df
+            df_items, index = self._load_full(content, digest, trace)
 
+        self._digest = digest
+        self._content_length = len(content)
+        self._header = content[:content.find(b'\n') + 1]
+        self.last_error = None
+        self._publish(df_items, index)
+        with trace.step('snapshot'):
+            self._save_snapshot()
+        trace.finish('append' if appended else 'full', len(df_items))
+
+    def _snapshot_meta(self):
+        return {
+            'url': self.url,
+            'digest': self._digest,
+            'etag': self._etag,
+            'last_modified': self._last_modified,
+            'content_length': self._content_length,
+            'header': self._header.decode('utf-8'),
+            'raw_rows': self._raw_rows,
+            'ffill_state': self._ffill_state,
+        }
+
+    def _save_snapshot(self):
+        if not self.snapshot_file:
+            return
+        try:
+            save_snapshot(self.snapshot_file, self.df, self._snapshot_meta())
+        except Exception as e:
+            logger.warning("Could not write snapshot %s: %s", self.snapshot_file, e)
+
+    def _restore_snapshot(self):
+        """Serves the last snapshot until the first network refresh lands."""
+        trace = LoadTrace(self.url)
+        with trace.step('snapshot'):
+            snapshot = load_snapshot(self.snapshot_file) if self.snapshot_file else None
+        if snapshot is None:
+            return False
+        df, meta = snapshot
+        if meta.get('url') != self.url:
+            return False
+
+        tag_frame(df, meta['digest'])
+        if self.build_index:
+            with trace.step('index'):
+                self.index = get_search_index(df)
+
+        self._digest = meta['digest']
+        self._etag = meta['etag']
+        self._last_modified = meta['last_modified']
+        self._content_length = meta['content_length']
+        self._header = meta['header'].encode('utf-8')
+        self._raw_rows = meta['raw_rows']
+        self._ffill_state = meta['ffill_state']
+        self.df = df
+        # Stale on purpose: the next get() starts a background refresh
+        self.loaded_at = 0.0
+        trace.finish('snapshot', len(df))
+        return True
+
+    def _is_append(self, content):
+        # The old export must be an exact prefix that ended on a full line
+        old = content[:self._content_length]
+        return (
+            len(content) > self._content_length
+            and old.endswith(b'\n')
+            and content.startswith(self._header)
+            and hashlib.blake2b(old, digest_size=8).hexdigest() == self._digest
+        )
+
+    def _load_full(self, content, digest, trace):
+        """
+        Parses and cleans the export chunk by chunk and indexes it as it grows.
+        On the very first load the growing frame is published after the first
+        chunk and then each time it doubled, so queries start early.
+        Returns (frame, its index or None).
+        """
+        publish = self.df is None
+        pieces, ffill_state, index = [], None, None
+        self._raw_rows = rows = published_rows = 0
+        for chunk_items, ffill_state, raw_rows in read_inventory_chunks(io.BytesIO(content), trace=trace):
+            pieces.append(chunk_items)
+            self._raw_rows += raw_rows
+            rows += len(chunk_items)
+            if publish and rows >= max(2 * published_rows, 1):
+                df_items, index = self._grow(pieces, f"{digest}:{rows}", index, trace)
+                pieces, published_rows = [df_items], rows
+                self._publish(df_items, index)
+
+        self._ffill_state = ffill_state
+        with trace.step('clean'):
+            # A new frame object even when nothing was added: published frames are never relabelled
+            df_items = concat_chunks(pieces).copy(deep=False)
+        df_items.attrs = {}
+        tag_frame(df_items, digest)
+        if self.build_index:
+            old_rows = None
+            if not publish:
+                # A refresh: find the rows that did not change since the previous frame
+                with trace.step('diff'):
+                    old_rows = self.changes.track(self.df, df_items)
+            with trace.step('index'):
+                if old_rows is not None:
+                    index = self.index.updated(df_items, old_rows)
+                elif index is not None:
+                    # Extending covers only the rows parsed since the last publication
+                    index = index.extended(df_items)
+                else:
+                    index = get_search_index(df_items)
+                register_search_index(index)
+        return df_items, index
+
+    def _grow(self, pieces, version, index, trace):
+        # The frame so far, and its index extended with the new rows
+        with trace.step('clean'):
+            df = concat_chunks(pieces).copy(deep=False)
+        df.attrs = {'partial': True}
+        tag_frame(df, version)
+        if self.build_index:
+            with trace.step('index'):
+                index = get_search_index(df) if index is None else index.extended(df)
+                register_search_index(index)
+        return df, index
+
+    def _load_appended(self, content, trace):
+        source = io.BytesIO(self._header + content[self._content_length:])
+        pieces = []
+        for chunk_items, self._ffill_state, raw_rows in read_inventory_chunks(
+            source, self._ffill_state, self._raw_rows, trace
+        ):
+            pieces.append(chunk_items)
+            self._raw_rows += raw_rows
+        with trace.step('clean'):
+            return concat_inventory(self.df, concat_chunks(pieces))
+
+
+class InventoryStore:
+    """
+    Several sheets merged into one frame, with their name in SOURCE_COLUMN.
+
+    The sheets are fetched concurrently and each keeps its own refresh,
+    snapshot and append logic (InventorySource); the store re-merges them only
+    when one of their versions changed, and only the merged frame is indexed.
+    Per-source access is a row mask over the merged frame (see source_mask).
+    Each new merged frame is diffed against the previous one, so its index is
+    updated for the changed rows only and the movements land in `changes`.
+    """
+
+    def __init__(self, sources):
+        # name -> InventorySource
+        self.sources = sources
+        self.df = None
+        # Index of the merged frame, kept here so the next merge can update it
+        self.index = None
+        self.changes = ChangeTracker()
+        self._versions = None
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded_at(self):
+        return min(source.loaded_at for source in self.sources.values())
+
+    @property
+    def last_error(self):
+        return next((source.last_error for source in self.sources.values() if source.last_error), None)
+
+    def get(self):
+        """Returns the merged frame (same contract as InventorySource.get)."""
+        results = list(_FETCH_POOL.map(_get_or_error, self.sources.values()))
+        if all(isinstance(result, Exception) for result in results):
+            raise results[0]
+        # One unreachable sheet must not hide the others
+        frames = {name: pd.DataFrame() if isinstance(result, Exception) else result
+                  for name, result in zip(self.sources, results)}
+        versions = tuple(frame_version(df) for df in frames.values())
+        loaded = tuple(not isinstance(result, Exception) for result in results)
+        with self._lock:
+            if versions != self._versions:
+                df = merge_inventories(frames)
+                df.attrs['partial'] = any(frame.attrs.get('partial') for frame in frames.values())
+                tag_frame(df, hashlib.blake2b("|".join(versions).encode('utf-8'), digest_size=8).hexdigest())
+                # A sheet coming back after a failed load is not a stock movement
+                old_rows = self.changes.track(self.df, df, record=loaded == self._loaded)
+                if old_rows is None:
+                    index = get_search_index(df)
+                else:
+                    index = self.index.updated(df, old_rows)
+                    register_search_index(index)
+                self.df, self.index, self._versions, self._loaded = df, index, versions, loaded
+            return self.df
+
+
+def _get_or_error(source):
+    try:
+        return source.get()
+    except Exception as e:
+        logger.warning("Could not load %s: %s", source.url, e)
+        return e
+
+
+def merge_inventories(frames):
+    """Concatenates cleaned frames (name -> df) into one, tagging every row with its source name."""
+    frames = {name: df for name, df in frames.items() if not df.empty}
+    if not frames:
+        return pd.DataFrame()
+    names = list(frames)
+    merged = concat_chunks(list(frames.values())).reset_index(drop=True)
+    merged[SOURCE_COLUMN] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(names)), [len(df) for df in frames.values()]),
+        categories=[SOURCE_LABELS.get(name, name) for name in names],
+    )
+    return merged
+
+
+def source_mask(df, sources):
+    """Boolean row mask of the rows coming from `sources` (names) in a merged frame."""
+    if SOURCE_COLUMN not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return df[SOURCE_COLUMN].isin([SOURCE_LABELS.get(name, name) for name in sources]).to_numpy()
+
+
+@st.cache_resource
+def get_inventory_store():
+    """The merged store of every sheet for the whole server process."""
+    return InventoryStore({name: InventorySource(url, build_index=False) for name, url in SHEET_URLS.items()})
+
+
+def load_store():
+    """Same as load_data, for the merged store of every sheet."""
+    try:
+        return get_inventory_store().get()
+    except Exception as e:
+        st.error(f"Lỗi khi tải dữ liệu: {e}")
+        return pd.DataFrame()
+
+
+def recent_movements(sources, limit=None):
+    """Latest movements of the merged store, for the rows of `sources` (names) only."""
+    return get_inventory_store().changes.recent(limit, [SOURCE_LABELS.get(name, name) for name in sources])
+
+
+@st.cache_resource
+def get_inventory_source(url):
+    """One shared source per sheet URL for the whole server process."""
+    return InventorySource(url)
+
+
+def load_data(url, is_private=False):
+    """
+    Returns the cleaned inventory for this sheet.
+    The frame is shared by every session: treat it as read-only.
+    """
+    try:
+        return get_inventory_source(url).get()
     except Exception as e:
         st.error(f"Lỗi khi tải dữ liệu: {e}")
         return pd.DataFrame()
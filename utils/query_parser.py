@@ -0,0 +1,171 @@
+"""
+A small query language on top of the search index.
+
+    tt:hỏng kho:"Gò Vấp" nv:nhat      status, unit/warehouse and holder filters
+    serial:ZTEG00001050               exact serial (or a range covering it)
+    serial:215*                       serial prefix
+    camera -tt:hỏng                   free words match any field, '-' negates
+    "wifi ezviz"                      quotes keep a phrase together
+
+Every term is a filter and all of them must hold. The plan runs the indexed
+field filters first, most selective (fewest rows) first: the first one lists
+its rows, and every later filter only checks those candidates. Free words,
+which need a scan of the row text, come last.
+"""
+import re
+
+import numpy as np
+
+from utils.search_index import EMPTY_POSITIONS, fold_text
+
+SERIAL_FIELD = 'serial'
+UNIT_COLUMNS = ['QUẬN/HUYỆN', 'LOẠI KHO']
+# Field prefix (folded) -> indexed columns it filters on
+FIELD_ALIASES = {
+    'serial': SERIAL_FIELD, 'sn': SERIAL_FIELD,
+    'ten': ['Tên hàng hóa'], 'sp': ['Tên hàng hóa'],
+    'ma': ['Mã hàng hóa'],
+    'nv': ['NHÂN VIÊN NHẬN'],
+    'kho': UNIT_COLUMNS,
+    'qh': ['QUẬN/HUYỆN'], 'quan': ['QUẬN/HUYỆN'],
+    'tt': ['Trạng thái'],
+}
+# [-][field:]("phrase" | word)
+TERM_PATTERN = re.compile(r'(-?)(?:([^\s:"]+):)?(?:"([^"]*)"?|(\S+))')
+# Free words are scanned on every candidate row: cost them as the whole frame
+SCAN_COST = float('inf')
+
+
+class Term:
+    """One filter of a parsed query."""
+
+    def __init__(self, field, text, negate=False, phrase=False):
+        self.field = field
+        self.text = text
+        self.negate = negate
+        self.phrase = phrase
+
+    def __repr__(self):
+        return f"Term({self.field!r}, {self.text!r}, negate={self.negate}, phrase={self.phrase})"
+
+
+def parse_query(query):
+    """Splits a query into Terms. Unknown prefixes ("http:...") stay part of a free word."""
+    terms = []
+    for match in TERM_PATTERN.finditer(query):
+        negate, field, phrase, word = match.groups()
+        text = phrase if phrase is not None else word
+        if field is not None and fold_text(field) not in FIELD_ALIASES:
+            # Not a field filter: keep the token as typed
+            text, field = f"{field}:{text}", None
+        text = (text or '').strip()
+        # A dangling '-' negates nothing
+        if text and not (field is None and phrase is None and text == '-'):
+            terms.append(Term(fold_text(field) if field else None, text, bool(negate), phrase is not None))
+    return terms
+
+
+def query_key(terms):
+    """Cache key of parsed terms: spacing between terms is ignored, spacing inside a phrase is not."""
+    return tuple((term.field, fold_text(term.text), term.negate, term.phrase) for term in terms)
+
+
+def is_structured(terms):
+    """True when the query uses the language (a field, a negation or a quoted phrase)."""
+    return any(term.field or term.negate or term.phrase for term in terms)
+
+
+class _Step:
+    """A planned filter: `cost` estimates its rows, `rows()` lists them, `keep()` checks candidates."""
+
+    def __init__(self, term, cost, rows, keep):
+        self.term = term
+        self.cost = cost
+        self.rows = rows
+        self.keep = keep
+
+
+def _serial_step(term, index):
+    text = term.text
+    if text.endswith(('*', '...', '…')):
+        rows = index.serial_prefix(text.rstrip('*.…'))
+    else:
+        rows = index.serial_exact(text)
+        if not len(rows):
+            rows = index.serial_in_range(text)
+    # Serial lookups are binary searches: already cheap and exact, keep their rows
+    return _Step(term, len(rows), lambda: rows, lambda candidates: np.isin(candidates, rows))
+
+
+def _column_step(term, index, cols):
+    text = fold_text(term.text)
+    lookups = [(column, column.contain_ids(text)) for column in (index.columns.get(col) for col in cols) if column is not None]
+    cost = sum(column.row_count(ids) for column, ids in lookups)
+
+    def rows():
+        hits = [column.rows(ids) for column, ids in lookups]
+        hits = [h for h in hits if len(h)]
+        if not hits:
+            return EMPTY_POSITIONS
+        return hits[0] if len(hits) == 1 else np.unique(np.concatenate(hits))
+
+    def keep(candidates):
+        # Looks at the value codes of the candidate rows only
+        mask = np.zeros(len(candidates), dtype=bool)
+        for column, ids in lookups:
+            mask |= np.isin(column.codes[candidates], ids)
+        return mask
+
+    return _Step(term, cost, rows, keep)
+
+
+def _scan_step(term, index):
+    text = fold_text(term.text)
+
+    def keep(candidates):
+        return index.haystack.iloc[candidates].str.contains(text, regex=False).to_numpy(dtype=bool)
+
+    return _Step(term, SCAN_COST, lambda: np.flatnonzero(keep(np.arange(index.size))), keep)
+
+
+def plan_query(terms, index):
+    """Orders the filters: positive ones by estimated rows (text scans last), then negations."""
+    steps = []
+    for term in terms:
+        target = FIELD_ALIASES.get(term.field) if term.field else None
+        if target == SERIAL_FIELD:
+            steps.append(_serial_step(term, index))
+        elif target:
+            steps.append(_column_step(term, index, target))
+        else:
+            steps.append(_scan_step(term, index))
+    # Negations can only remove rows: never let one pick the candidates
+    # Between two text scans, the longer word usually keeps fewer rows
+    return sorted(steps, key=lambda step: (step.term.negate, step.cost, -len(step.term.text)))
+
+
+def _filter(step, candidates):
+    keep = step.keep(candidates)
+    return candidates[~keep if step.term.negate else keep]
+
+
+def run_query(terms, index, trace, allowed=None):
+    """Executes the plan, returns sorted row positions matching every term (and `allowed`)."""
+    candidates = None
+    for step in plan_query(terms, index):
+        # One trace tier per filter: 'tt', '-kho', 'text', ...
+        tier = f"{'-' if step.term.negate else ''}{step.term.field or 'text'}"
+        if candidates is None and not step.term.negate:
+            scanned = {'rows_scanned': index.size if step.cost == SCAN_COST else step.cost}
+            candidates = trace.run(tier, step.rows, scanned)
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+        else:
+            if candidates is None:
+                # Only negations: start from every (allowed) row
+                candidates = np.arange(index.size) if allowed is None else np.flatnonzero(allowed)
+            rows = candidates
+            candidates = trace.run(tier, lambda: _filter(step, rows), {'rows_scanned': len(rows)})
+        if not len(candidates):
+            return EMPTY_POSITIONS
+    return EMPTY_POSITIONS if candidates is None else np.sort(candidates)
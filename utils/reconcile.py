@@ -0,0 +1,111 @@
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.search_index import fold_text, get_search_index
+
+# Scanners and spreadsheets separate serials with newlines, tabs, commas or semicolons
+SERIAL_SEPARATORS = re.compile(r'[\s,;]+')
+# Header names recognised as the serial column of an uploaded CSV (folded)
+SERIAL_HEADERS = ('serial', 'sn', 'so serial', 'tu serial', 'ma serial')
+
+STATUS_MISSING = "❌ Không tìm thấy"
+STATUS_OTHER_HOLDER = "👤 Khác người giữ"
+STATUS_OTHER_DISTRICT = "📍 Khác khu vực"
+STATUS_MATCH = "✅ Khớp"
+
+REPORT_COLUMNS = ['Từ serial', 'Tên hàng hóa', 'Mã hàng hóa', 'NHÂN VIÊN NHẬN', 'QUẬN/HUYỆN', 'LOẠI KHO', 'Nguồn', 'Trạng thái']
+
+
+def parse_serials(text):
+    """Distinct serials of a pasted scan list, in scan order."""
+    return list(dict.fromkeys(s for s in SERIAL_SEPARATORS.split(text or '') if s))
+
+
+def read_scan_file(name, data):
+    """
+    Serials of an uploaded scan file (bytes). A CSV uses its serial column when
+    one is recognised, else its first column; anything else is read as a list.
+    """
+    text = data.decode('utf-8-sig', errors='replace')
+    if not name.lower().endswith('.csv') or not text.strip():
+        return parse_serials(text)
+
+    table = pd.read_csv(io.StringIO(text), dtype=str, header=None, skip_blank_lines=True)
+    if table.empty:
+        return []
+    header = [fold_text(str(value).strip()) for value in table.iloc[0]]
+    col = next((i for i, value in enumerate(header) if value in SERIAL_HEADERS), None)
+    values = table.iloc[1:, col] if col is not None else table.iloc[:, 0]
+    return parse_serials("\n".join(values.dropna().astype(str)))
+
+
+def index_lookup(serials, df):
+    """(scan positions, row positions) of `serials` in `df`, through its search index."""
+    return get_search_index(df).serial_lookup(serials)
+
+
+def _expected_mask(df, col, rows, expected):
+    # Only the matched rows are compared, each distinct value folded once
+    if not expected or col not in df.columns:
+        return np.ones(len(rows), dtype=bool)
+    target = fold_text(expected)
+    values = df[col].iloc[rows]
+    codes, uniques = pd.factorize(values.astype(object).where(values.notna(), '').astype(str))
+    hits = np.array([fold_text(value) == target for value in uniques], dtype=bool)
+    return hits[codes]
+
+
+def reconcile_serials(serials, df, holder=None, district=None, allowed=None, lookup=index_lookup):
+    """
+    Resolves a whole scan list against the inventory in one batch lookup.
+
+    Returns one report row per (scanned serial, matching inventory row); serials
+    with no match get a single row. `holder` / `district` are the expected
+    'NHÂN VIÊN NHẬN' / 'QUẬN/HUYỆN' of the stock-take (None skips the check).
+    Rows outside the `allowed` mask count as not found. `lookup(serials, df)`
+    does the batch lookup (the search service client answers it remotely).
+    """
+    serials = list(serials)
+    owner, rows = (lookup or index_lookup)(serials, df)
+    if allowed is not None:
+        keep = allowed[rows]
+        owner, rows = owner[keep], rows[keep]
+
+    same_holder = _expected_mask(df, 'NHÂN VIÊN NHẬN', rows, holder)
+    same_district = _expected_mask(df, 'QUẬN/HUYỆN', rows, district)
+    status = np.where(~same_holder, STATUS_OTHER_HOLDER, np.where(~same_district, STATUS_OTHER_DISTRICT, STATUS_MATCH))
+
+    found = pd.DataFrame({'Serial quét': np.asarray(serials, dtype=object)[owner], 'Kết quả': status, '_scan': owner})
+    cols = [c for c in REPORT_COLUMNS if c in df.columns]
+    found = pd.concat([found, df.iloc[rows][cols].reset_index(drop=True).astype(object)], axis=1)
+
+    missing_at = np.setdiff1d(np.arange(len(serials)), owner)
+    missing = pd.DataFrame({'Serial quét': np.asarray(serials, dtype=object)[missing_at],
+                            'Kết quả': STATUS_MISSING, '_scan': missing_at})
+
+    report = pd.concat([found, missing], ignore_index=True)
+    # Back to scan order, several matches of one serial stay together
+    report = report.sort_values('_scan', kind='stable').drop(columns='_scan').reset_index(drop=True)
+    return report
+
+
+def summarize_report(report):
+    """Scanned / found / missing serial counts and mismatching rows per status."""
+    by_status = report['Kết quả'].value_counts()
+    missing = int(by_status.get(STATUS_MISSING, 0))
+    scanned = report['Serial quét'].nunique()
+    return {
+        'scanned': scanned,
+        'found': scanned - missing,
+        'missing': missing,
+        'other_holder': int(by_status.get(STATUS_OTHER_HOLDER, 0)),
+        'other_district': int(by_status.get(STATUS_OTHER_DISTRICT, 0)),
+    }
+
+
+def report_csv(report):
+    """The report as CSV bytes (with BOM, so Excel shows Vietnamese text correctly)."""
+    return report.to_csv(index=False).encode('utf-8-sig')
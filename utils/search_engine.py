@@ -1,110 +1,256 @@
-from thefuzz import process, fuzz
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
+from utils.query_parser import UNIT_COLUMNS, is_structured, parse_query, query_key, run_query
+from utils.search_index import EMPTY_POSITIONS, SUGGEST_LIMIT, fold_text, frame_version, get_search_index, mask_version
+from utils.telemetry import QueryTrace
+
+# Fuzzy tier vocabulary (typos in product / employee names)
+FUZZY_COLUMNS = {'Tên hàng hóa': 'sản phẩm', 'NHÂN VIÊN NHẬN': 'nhân viên'}
+FUZZY_LIMIT = 5
+
+NOT_FOUND_MESSAGE = """**🤔 Hmm, tôi không tìm thấy thông tin nào cho từ khóa này.**
+    
+Là **Trợ lý Kho chuyên nghiệp**, tôi gợi ý bạn:
+1.  🔍 **Kiểm tra Serial:** Đảm bảo nhập đúng chính xác (vd: `21200...`).
+2.  📦 **Tên sản phẩm:** Thử nhập tên ngắn gọn (vd: `Switch` thay vì `Switch 8 cổng...`).
+3.  👤 **Tên nhân viên:** Gõ có dấu hay không dấu đều được (vd: `vo minh nhat`).
+
+*Bạn hãy thử lại xem sao nhé!* 👇"""
 
-def search_inventory(query, df):
+STRUCTURED_NOT_FOUND_MESSAGE = """**🤔 Không có dòng nào khớp tất cả điều kiện của '{query}'.**
+
+Thử bỏ bớt một điều kiện, hoặc kiểm tra lại cú pháp:
+`serial:` · `ten:` · `ma:` · `nv:` · `kho:` · `tt:`, thêm `-` phía trước để loại trừ (vd: `-tt:hỏng`), `"..."` để giữ nguyên cụm từ."""
+
+
+class QueryCache:
+    """Bounded LRU of search results keyed on (dataset version, normalized query).
+
+    Stores row positions, never DataFrame copies. Entries of an older dataset
+    version are never hit again once load_data brings in new data: they age
+    out of the LRU, and everything beyond the last `max_versions` is dropped.
     """
-    Search inventory by Serial, Product Name, or Employee Name.
-    Prioritizes Exact/Substring matches over Fuzzy matching.
+
+    def __init__(self, max_entries=1024, max_versions=4):
+        self.max_entries = max_entries
+        self.max_versions = max_versions
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, query):
+        """Returns (positions, template, tier) or None."""
+        with self._lock:
+            entry = self._entries.get((version, query))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end((version, query))
+            return entry
+
+    def put(self, version, query, positions, template, tier=None):
+        # Shared across sessions: make sure nobody edits a cached result in place
+        positions.flags.writeable = False
+        with self._lock:
+            self._versions[version] = True
+            self._versions.move_to_end(version)
+            if len(self._versions) > self.max_versions:
+                stale, _ = self._versions.popitem(last=False)
+                for key in [k for k in self._entries if k[0] == stale]:
+                    del self._entries[key]
+
+            self._entries[(version, query)] = (positions, template, tier)
+            self._entries.move_to_end((version, query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'versions': len(self._versions),
+            }
+
+
+_QUERY_CACHE = QueryCache()
+
+
+def get_query_cache_stats():
+    """Returns the hit/miss counters of the shared query result cache."""
+    return _QUERY_CACHE.stats()
+
+
+def normalize_query(query):
+    """Cache key of a query: folded, with whitespace collapsed."""
+    return " ".join(fold_text(query).split())
+
+
+def search_positions(query, df, allowed=None):
+    """
+    Same as search_inventory, but returns row positions (for df.iloc) instead of a DataFrame.
+    `allowed` is an optional boolean row mask (access control): other rows are never returned.
+    Results are served from the shared query cache when possible.
+    Every call emits a structured trace (see utils.telemetry).
     """
     if df.empty or query.strip() == "":
-        return pd.DataFrame(), "Chưa có dữ liệu tìm kiếm."
+        return EMPTY_POSITIONS, "Chưa có dữ liệu tìm kiếm."
 
+    version = frame_version(df)
+    terms = parse_query(query)
+    # Results depend on the row mask too; a quoted phrase keeps its own spacing
+    key = (mask_version(allowed), query_key(terms) if is_structured(terms) else normalize_query(query))
     query = query.strip()
-    query_lower = query.lower()
-    
-    # 1. EXACT SEARCH: Serial Number (Highest Priority)
-    serial_match = df[df['Từ serial'].str.lower() == query_lower]
-    if not serial_match.empty:
-        return serial_match, f"Tìm thấy theo Serial: {query}"
-        
-    # 2. SUBSTRING SEARCH: Product Name (High Priority)
-    # Finds "IP952" in "ATV_HISENSE_IP952..."
-    prod_contain = df[df['Tên hàng hóa'].str.contains(query, case=False, na=False)]
-    
-    # 3. SUBSTRING SEARCH: Employee Name
-    emp_contain = pd.DataFrame()
-    if 'NHÂN VIÊN NHẬN' in df.columns:
-        emp_contain = df[df['NHÂN VIÊN NHẬN'].str.contains(query, case=False, na=False)]
+    trace = QueryTrace(query, version)
+    cached = _QUERY_CACHE.get(version, key)
+    if cached is not None:
+        positions, template, tier = cached
+        trace.finish('hit', len(positions), answered_by=tier)
+    else:
+        positions, template = _run_tiers(query, df, get_search_index(df), trace, allowed)
+        _QUERY_CACHE.put(version, key, positions, template, trace.answered_by)
+        trace.finish('miss', len(positions))
+    return positions, template.format(query=query, prefix=_serial_prefix(query))
 
-    # 4. SUBSTRING SEARCH: Product Code (Mã hàng hóa)
-    code_contain = pd.DataFrame()
-    if 'Mã hàng hóa' in df.columns:
-        code_contain = df[df['Mã hàng hóa'].str.contains(query, case=False, na=False)]
-
-    # 4b. SUBSTRING SEARCH: Unit/Warehouse (Kho đơn vị)
-    unit_contain = pd.DataFrame()
-    possible_unit_cols = ['QUẬN/HUYỆN', 'LOẠI KHO']
-    for col in possible_unit_cols:
-        if col in df.columns:
-            matches = df[df[col].astype(str).str.contains(query, case=False, na=False)]
-            if not matches.empty:
-                unit_contain = pd.concat([unit_contain, matches])
-    
-    if not unit_contain.empty:
-        unit_contain = unit_contain.drop_duplicates()
 
-    # 5. SUBSTRING SEARCH: Serial (Fallback for partial serials)
-    serial_contain = df[df['Từ serial'].str.contains(query, case=False, na=False)]
+def suggest_completions(text, df, allowed=None, limit=SUGGEST_LIMIT):
+    """Search-as-you-type completions of `text`: (column, value, row count) tuples."""
+    if df.empty:
+        return []
+    return get_search_index(df).suggest(text, limit, allowed)
 
-    # 6. COMBINED KEYWORD SEARCH (AND Logic)
+
+def search_inventory(query, df, allowed=None):
+    """
+    Search inventory by Serial, Product Name, or Employee Name.
+    Prioritizes Exact/Substring matches over Fuzzy matching.
+    """
+    positions, message = search_positions(query, df, allowed)
+    if not len(positions):
+        return pd.DataFrame(), message
+    return df.iloc[positions], message
+
+
+def _serial_prefix(query):
+    # The sidebar tip writes prefixes as `215...`
+    return query.rstrip('.…')
+
+
+def _escape(text):
+    # Data values end up inside a str.format template
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def _run_tiers(query, df, index, trace, allowed=None):
+    """Runs the search cascade, returns (row positions, message template).
+
+    Templates only reference {query}/{prefix}, so a cached result can be
+    replayed for another spelling of the same normalized query. With an
+    `allowed` row mask, every tier only sees the allowed rows.
+    """
+    def visible(positions):
+        return positions if allowed is None else positions[allowed[positions]]
+
+    # 0. STRUCTURED QUERY: field filters, negation, quoted phrases (see utils.query_parser)
+    # All filters must hold, so it replaces the cascade instead of being one of its tiers
+    terms = parse_query(query)
+    if is_structured(terms):
+        positions = run_query(terms, index, trace, allowed)
+        trace.answered_by = 'structured' if len(positions) else None
+        if len(positions):
+            return positions, f"Tìm thấy {len(positions)} kết quả khớp mọi điều kiện: '{{query}}'"
+        return EMPTY_POSITIONS, STRUCTURED_NOT_FOUND_MESSAGE
+
+    # Accent-insensitive: "vo minh nhat" and "Võ Minh Nhật" are the same lookup
+    query_folded = fold_text(query)
+
+    # Tiers run lazily in priority order: a tier is only computed when every
+    # tier above it came back empty. Each lookup touches candidate rows only.
+
+    # 1. EXACT SEARCH: Serial Number (Highest Priority)
+    positions = trace.run('serial_exact', lambda: visible(index.serial_exact(query)))
+    if len(positions):
+        return positions, "Tìm thấy theo Serial: {query}"
+
+    # 1b. RANGE SEARCH: Serial inside a 'Từ serial' - 'Đến serial' range
+    positions = trace.run('serial_range', lambda: visible(index.serial_in_range(query)))
+    if len(positions):
+        return positions, "Tìm thấy Serial {query} trong dải serial đã cấp"
+
+    # 2. COMBINED KEYWORD SEARCH (AND Logic)
     # Allows "42x Võ Minh Nhật" -> Finds items with "42x" AND "Võ Minh Nhật" in any field
-    tokens = query.split()
+    tokens = query_folded.split()
     if len(tokens) > 1:
-        # Start with all True
-        full_mask = pd.Series([True] * len(df))
-        
-        # For each word, it must exist in AT LEAST ONE of the columns
-        for token in tokens:
-            token_mask = (
-                df['Tên hàng hóa'].str.contains(token, case=False, na=False) |
-                df['Từ serial'].str.contains(token, case=False, na=False)
-            )
-            if 'NHÂN VIÊN NHẬN' in df.columns:
-                token_mask |= df['NHÂN VIÊN NHẬN'].str.contains(token, case=False, na=False)
-            if 'Mã hàng hóa' in df.columns:
-                 token_mask |= df['Mã hàng hóa'].str.contains(token, case=False, na=False)
-            if 'Trạng thái' in df.columns:
-                 token_mask |= df['Trạng thái'].str.contains(token, case=False, na=False)
-            
-            # Add Unit Search to Combined Logic
-            possible_unit_cols = ['QUẬN/HUYỆN', 'LOẠI KHO']
-            for col in possible_unit_cols:
-                if col in df.columns:
-                    token_mask |= df[col].astype(str).str.contains(token, case=False, na=False)
-
-            # Combine with AND: The row must satisfy THIS token too
-            full_mask = full_mask & token_mask
-
-        combined_results = df[full_mask]
-        if not combined_results.empty:
-             return combined_results, f"Tìm thấy {len(combined_results)} kết quả tổng hợp cho: '{query}'"
-
-    # COMBINE RESULTS
-    # Priority: Product Name > Product Code > Employee > Serial
-    
-    if not prod_contain.empty:
-        return prod_contain, f"Tìm thấy {len(prod_contain)} sản phẩm có tên chứa: '{query}'"
-        
-    if not code_contain.empty:
-        return code_contain, f"Tìm thấy {len(code_contain)} sản phẩm có mã chứa: '{query}'"
-    
-    if not emp_contain.empty:
-        return emp_contain, f"Tìm thấy {len(emp_contain)} tài sản của nhân viên: '{query}'"
+        scan = {}
+        positions = trace.run('combined', lambda: visible(np.flatnonzero(index.match_all(tokens, scan))), scan)
+        if len(positions):
+            return positions, f"Tìm thấy {len(positions)} kết quả tổng hợp cho: '{{query}}'"
+
+    # 3. SUBSTRING SEARCH: Product Name (High Priority)
+    # Finds "IP952" in "ATV_HISENSE_IP952..."
+    positions = trace.run('product_name', lambda: visible(index.contains('Tên hàng hóa', query_folded)))
+    if len(positions):
+        return positions, f"Tìm thấy {len(positions)} sản phẩm có tên chứa: '{{query}}'"
+
+    # 4. SUBSTRING SEARCH: Product Code (Mã hàng hóa)
+    positions = trace.run('product_code', lambda: visible(index.contains('Mã hàng hóa', query_folded)))
+    if len(positions):
+        return positions, f"Tìm thấy {len(positions)} sản phẩm có mã chứa: '{{query}}'"
+
+    # 5. SUBSTRING SEARCH: Employee Name
+    positions = trace.run('employee', lambda: visible(index.contains('NHÂN VIÊN NHẬN', query_folded)))
+    if len(positions):
+        return positions, f"Tìm thấy {len(positions)} tài sản của nhân viên: '{{query}}'"
 
-    if not unit_contain.empty:
+    # 6. SUBSTRING SEARCH: Unit/Warehouse (Kho đơn vị)
+    positions = trace.run('unit', lambda: visible(index.contains_any(UNIT_COLUMNS, query_folded)))
+    if len(positions):
         # Group by Unit if possible for better message
-        found_units = unit_contain['QUẬN/HUYỆN'].unique() if 'QUẬN/HUYỆN' in unit_contain.columns else []
-        unit_str = ", ".join(str(u) for u in found_units[:3])
-        return unit_contain, f"Tìm thấy {len(unit_contain)} kết quả tại kho/đơn vị: {unit_str}..."
-        
-    if not serial_contain.empty:
-        return serial_contain, f"Tìm thấy Serial chứa: '{query}'"
-
-    return pd.DataFrame(), """**🤔 Hmm, tôi không tìm thấy thông tin nào cho từ khóa này.**
-    
-Là **Trợ lý Kho chuyên nghiệp**, tôi gợi ý bạn:
-1.  🔍 **Kiểm tra Serial:** Đảm bảo nhập đúng chính xác (vd: `21200...`).
-2.  📦 **Tên sản phẩm:** Thử nhập tên ngắn gọn (vd: `Switch` thay vì `Switch 8 cổng...`).
-3.  👤 **Tên nhân viên:** Nhập tên không dấu nếu có dấu không ra kết quả.
+        found_units = df['QUẬN/HUYỆN'].iloc[positions].unique() if 'QUẬN/HUYỆN' in df.columns else []
+        unit_str = _escape(", ".join(str(u) for u in found_units[:3]))
+        return positions, f"Tìm thấy {len(positions)} kết quả tại kho/đơn vị: {unit_str}..."
 
-*Bạn hãy thử lại xem sao nhé!* 👇"""
+    # 7. PREFIX SEARCH: Serial (vd: `215...`), binary search over sorted serials
+    positions = trace.run('serial_prefix', lambda: visible(index.serial_prefix(_serial_prefix(query))))
+    if len(positions):
+        return positions, f"Tìm thấy {len(positions)} Serial bắt đầu bằng: '{{prefix}}'"
+
+    # 8. SUBSTRING SEARCH: Serial (Fallback for partial serials)
+    positions = trace.run('serial_contains', lambda: visible(index.contains('Từ serial', query_folded)))
+    if len(positions):
+        return positions, "Tìm thấy Serial chứa: '{query}'"
+
+    # 9. FUZZY SEARCH: typos in product / employee names, ranked by score
+    def fuzzy():
+        matches = [(col, label, score, visible(rows)) for col, label, score, rows in
+                   index.fuzzy(query, list(FUZZY_COLUMNS), limit=FUZZY_LIMIT, allowed=allowed)]
+        return [match for match in matches if len(match[3])]
+
+    matches = trace.run('fuzzy', fuzzy)
+    if matches:
+        positions = np.concatenate([rows for _, _, _, rows in matches])
+        # Keep the ranking order, a row can belong to a product and an employee match
+        _, first = np.unique(positions, return_index=True)
+        positions = positions[np.sort(first)]
+        suggestions = "\n".join(
+            f"- **{_escape(label)}** ({FUZZY_COLUMNS[col]}, {score}%)" for col, label, score, _ in matches
+        )
+        return positions, f"Không có kết quả chính xác cho '{{query}}'. Có phải bạn muốn tìm:\n{suggestions}"
+
+    return EMPTY_POSITIONS, NOT_FOUND_MESSAGE
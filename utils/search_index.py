@@ -0,0 +1,753 @@
+import copy
+import hashlib
+import re
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from thefuzz import fuzz, process
+
+# Columns the search engine looks into (only those present in the sheet are indexed)
+SEARCH_COLUMNS = ['Từ serial', 'Tên hàng hóa', 'Mã hàng hóa', 'NHÂN VIÊN NHẬN', 'Trạng thái', 'QUẬN/HUYỆN', 'LOẠI KHO']
+
+# Columns concatenated into the per-row haystack of the combined keyword search
+HAYSTACK_COLUMNS = ['Tên hàng hóa', 'Từ serial', 'NHÂN VIÊN NHẬN', 'Mã hàng hóa', 'Trạng thái', 'QUẬN/HUYỆN', 'LOẠI KHO']
+# Never typed by users, so a token can not match across two fields
+HAYSTACK_SEPARATOR = '\x1f'
+
+NGRAM_SIZE = 3
+EMPTY_POSITIONS = np.array([], dtype=np.int64)
+
+# Above this many matching values it is cheaper to mask the codes than to gather slices
+MAX_SLICED_IDS = 64
+
+# Fuzzy tier: only the values sharing the most trigrams with the query get scored
+FUZZY_CANDIDATES = 200
+FUZZY_SCORE_CUTOFF = 70
+
+# "ZTEG1234567" -> ("zteg", "1234567"): serial ranges only vary in the trailing digits
+SERIAL_PATTERN = re.compile(r'^(.*?)(\d+)$')
+# Trailing digits beyond this do not fit in int64
+MAX_RANGE_DIGITS = 18
+
+# Columns whose distinct values are offered as search-as-you-type completions
+SUGGEST_COLUMNS = ['Tên hàng hóa', 'Mã hàng hóa', 'NHÂN VIÊN NHẬN', 'Từ serial']
+SUGGEST_LIMIT = 8
+# A completion can also start at any later word: "minh nhat" -> "Võ Minh Nhật"
+WORD_BOUNDARY = re.compile(r'[\s_\-/(),.]+')
+
+
+# Frames whose attrs['version'] can be trusted. pandas copies attrs into every
+# slice and copy of a frame, so only the very object that was tagged qualifies
+_TAGGED_FRAMES = weakref.WeakValueDictionary()
+
+
+def tag_frame(df, version):
+    """Sets the version frame_version returns for `df` itself (not for frames derived from it)."""
+    df.attrs['version'] = version
+    _TAGGED_FRAMES[id(df)] = df
+    return df
+
+
+def frame_version(df):
+    """Returns a short content hash identifying one load_data result."""
+    version = df.attrs.get('version')
+    if version and _TAGGED_FRAMES.get(id(df)) is df:
+        return version
+
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update("\x1f".join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def mask_version(allowed):
+    """Short content hash of a boolean row mask (None for "every row")."""
+    if allowed is None:
+        return None
+    return hashlib.blake2b(np.packbits(allowed).tobytes(), digest_size=8).hexdigest()
+
+
+def fold_text(text):
+    """Lowercases and strips Vietnamese diacritics ("Võ Minh Nhật" -> "vo minh nhat")."""
+    if text.isascii():
+        # Serials and codes: nothing to strip
+        return text.lower()
+    text = unicodedata.normalize('NFD', text.lower()).replace('đ', 'd')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def _folded(series):
+    """(codes, folded distinct values) of `series`: each distinct value is folded once."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        uniques = [str(value) for value in series.cat.categories] + ['']
+        codes = series.cat.codes.to_numpy()
+        codes = np.where(codes < 0, len(uniques) - 1, codes)
+    else:
+        values = series.astype(object).where(series.notna(), '').astype(str)
+        codes, uniques = pd.factorize(values)
+    values = pd.Series(uniques, dtype=object)
+    # Serials and codes are ASCII: lowercased in one vectorized pass
+    ascii = values.str.isascii().to_numpy(dtype=bool)
+    folded = np.array(values.str.lower(), dtype=object)
+    folded[~ascii] = [fold_text(value) for value in values[~ascii]]
+    return codes, folded
+
+
+def match_rows(df, positions, tokens):
+    """Boolean mask over `positions`: every token appears somewhere in the row.
+
+    Same matching as SearchIndex.match_all, but only the distinct values of
+    the rows at `positions` are folded, so no index of the whole frame is needed.
+    """
+    mask = np.zeros(len(positions), dtype=bool)
+    tokens = sorted({fold_text(t) for t in tokens if t.strip()}, key=len, reverse=True)
+    if not tokens:
+        return mask
+
+    columns = [_folded(df[col].iloc[positions]) for col in HAYSTACK_COLUMNS if col in df.columns]
+    mask[:] = True
+    for token in tokens:
+        # A token never spans two columns of the haystack, so test each column's values
+        hits = np.zeros(len(positions), dtype=bool)
+        for codes, values in columns:
+            hits |= np.fromiter((token in value for value in values), dtype=bool, count=len(values))[codes]
+        mask &= hits
+    return mask
+
+
+def _ngrams(text):
+    """Returns the set of trigrams of a (folded) string."""
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class ColumnIndex:
+    """Trigram posting lists for one column.
+
+    Postings point at distinct values rather than rows: the sheet repeats the
+    same product / employee / district on every detail row after ffill, so the
+    vocabulary is far smaller than the frame. Matching values are expanded to
+    row positions through the per-row value codes.
+
+    The vocabulary is the accent-folded shadow of the column, so "vo minh nhat"
+    and "Võ Minh Nhật" hit the same entry with a single lookup.
+    """
+
+    def __init__(self, series=None):
+        self.codes = np.array([], dtype=np.int32)
+        self.vocab = np.array([], dtype=object)
+        # One original spelling per folded value, for display
+        self.labels = np.array([], dtype=object)
+        self.value_ids = {}
+        self.postings = {}
+        if series is not None:
+            self._append(series)
+
+    def extended(self, series):
+        """Returns a copy of this index with `series` appended as new rows.
+
+        Only the new values are folded and tokenized; this index is left
+        untouched so sessions still reading it are not disturbed.
+        """
+        clone = copy.copy(self)
+        clone.value_ids = dict(self.value_ids)
+        clone.postings = dict(self.postings)
+        clone._append(series)
+        return clone
+
+    def reindexed(self, series):
+        """Returns the index of `series` (a whole new column), reusing this vocabulary.
+
+        Only values never seen before are folded and tokenized. Values that
+        disappeared stay in the vocabulary with no rows.
+        """
+        clone = copy.copy(self)
+        clone.value_ids = dict(self.value_ids)
+        clone.postings = dict(self.postings)
+        clone.codes = np.array([], dtype=np.int32)
+        clone._append(series)
+        return clone
+
+    def live_values(self):
+        """Number of vocabulary values that still have rows."""
+        return int(np.count_nonzero(np.diff(self.offsets)))
+
+    def _append(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Already dictionary-encoded: only the categories are folded, rows stay as codes
+            raw_uniques = [str(value) for value in series.cat.categories] + ['']
+            raw_codes = series.cat.codes.to_numpy()
+            raw_codes = np.where(raw_codes < 0, len(raw_uniques) - 1, raw_codes)
+        else:
+            values = series.astype(object).where(series.notna(), '').astype(str)
+            # Factorize raw values first (C speed), then merge values that only differ by case/accents
+            raw_codes, raw_uniques = pd.factorize(values)
+        # Raw values spelled like a known label map to its id without being folded again
+        ids = np.full(len(raw_uniques), -1, dtype=np.int32)
+        if len(self.labels):
+            ids[:] = pd.Index(self.labels).get_indexer(pd.Index(raw_uniques, dtype=object))
+        new_values, new_labels = [], []
+        for i in np.flatnonzero(ids < 0):
+            raw = raw_uniques[i]
+            folded = fold_text(raw)
+            vid = self.value_ids.get(folded)
+            if vid is None:
+                vid = self.value_ids[folded] = len(self.value_ids)
+                new_values.append(folded)
+                new_labels.append(raw)
+            ids[i] = vid
+
+        if new_values:
+            first_new = len(self.vocab)
+            self.vocab = np.concatenate([self.vocab, np.array(new_values, dtype=object)])
+            self.labels = np.concatenate([self.labels, np.array(new_labels, dtype=object)])
+
+            grams = {}
+            for vid, value in enumerate(new_values, start=first_new):
+                for gram in _ngrams(value):
+                    grams.setdefault(gram, []).append(vid)
+            # New ids are larger than every existing one, so posting lists stay sorted
+            for gram, vids in grams.items():
+                vids = np.asarray(vids, dtype=np.int32)
+                known = self.postings.get(gram)
+                self.postings[gram] = vids if known is None else np.concatenate([known, vids])
+
+        self.codes = np.concatenate([self.codes, ids[raw_codes]])
+
+        # value id -> rows, as a CSR layout: rows of value v are order[offsets[v]:offsets[v + 1]]
+        self.order = np.argsort(self.codes, kind='stable')
+        self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.codes, minlength=len(self.vocab)), out=self.offsets[1:])
+
+    def equal_ids(self, text):
+        """Ids of the values equal to `text` (already folded)."""
+        vid = self.value_ids.get(text)
+        return np.array([], dtype=np.int32) if vid is None else np.array([vid], dtype=np.int32)
+
+    def contain_ids(self, fragment):
+        """Ids of the values containing `fragment` (already folded)."""
+        grams = _ngrams(fragment)
+        if not grams:
+            # Too short for a trigram: scan the vocabulary, never the rows
+            return np.flatnonzero(pd.Series(self.vocab, dtype=object).str.contains(fragment, regex=False)).astype(np.int32)
+
+        lists = []
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is None:
+                return np.array([], dtype=np.int32)
+            lists.append(ids)
+
+        # Intersect from the rarest trigram up so the working set only shrinks
+        lists.sort(key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+            if not len(candidates):
+                return candidates
+
+        # Trigrams can match out of order, verify the real substring on the survivors
+        keep = [fragment in value for value in self.vocab[candidates]]
+        return candidates[np.asarray(keep, dtype=bool)]
+
+    def similar_ids(self, text, limit, keep=None):
+        """Ids of the values sharing the most trigrams with `text` (already folded).
+        `keep` is an optional boolean mask over the vocabulary: other values are never returned."""
+        lists = [self.postings[gram] for gram in _ngrams(text) if gram in self.postings]
+        if not lists:
+            return np.array([], dtype=np.int32)
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.vocab))
+        if keep is not None:
+            shared[~keep] = 0
+        if len(shared) > limit:
+            top = np.argpartition(shared, -limit)[-limit:]
+        else:
+            top = np.arange(len(shared))
+        return top[shared[top] > 0]
+
+    def row_count(self, ids):
+        """Number of rows holding one of the value ids, without listing them."""
+        return int((self.offsets[ids + 1] - self.offsets[ids]).sum())
+
+    def rows(self, ids):
+        """Expands value ids to sorted row positions."""
+        if not len(ids):
+            return EMPTY_POSITIONS
+        if len(ids) == 1:
+            return self.order[self.offsets[ids[0]]:self.offsets[ids[0] + 1]]
+        if len(ids) <= MAX_SLICED_IDS:
+            return np.sort(np.concatenate([self.order[self.offsets[v]:self.offsets[v + 1]] for v in ids]))
+        return np.flatnonzero(np.isin(self.codes, ids))
+
+
+class SerialIndex:
+    """Exact, prefix and range lookups on 'Từ serial'.
+
+    Exact hits are a dict lookup, prefixes a binary search over the sorted
+    distinct serials, and 'Từ serial'/'Đến serial' pairs are kept as numeric
+    ranges so a serial inside a range is found even if it is never listed.
+    """
+
+    def __init__(self, column, df):
+        self.column = column
+        self.sorted_ids = np.argsort(column.vocab, kind='stable').astype(np.int32)
+        self.sorted_serials = column.vocab[self.sorted_ids]
+        self.ranges = self._merge_ranges({}, self._range_items(column, df, np.arange(len(df))))
+
+    def extended(self, column, tail, row_offset):
+        """Returns a copy covering `column` (an extended index) with `tail` rows appended."""
+        clone = self._with_vocab(column)
+        rows = np.arange(row_offset, row_offset + len(tail))
+        clone.ranges = self._merge_ranges(self.ranges, self._range_items(column, tail, rows))
+        return clone
+
+    def updated(self, column, df, old_rows):
+        """
+        Returns the serial index of `df`, whose `column` was reindexed from this one.
+        old_rows[i] is the row of the previous frame identical to row i, or -1:
+        only the ranges of the other rows are parsed again.
+        """
+        clone = self._with_vocab(column)
+        kept = np.flatnonzero(old_rows >= 0)
+        new_row = np.full(self.column.codes.shape[0], -1, dtype=np.int64)
+        new_row[old_rows[kept]] = kept
+
+        ranges = {}
+        for key, (lows, highs, rows) in self.ranges.items():
+            moved = new_row[rows]
+            keep = moved >= 0
+            # Dropping entries keeps the arrays sorted by their low end
+            if keep.any():
+                ranges[key] = (lows[keep], highs[keep], moved[keep])
+        changed = np.flatnonzero(old_rows < 0)
+        clone.ranges = self._merge_ranges(ranges, self._range_items(column, df.iloc[changed], changed))
+        return clone
+
+    def _with_vocab(self, column):
+        # A copy over `column`, whose vocabulary extends this one's
+        clone = copy.copy(self)
+        clone.column = column
+
+        # Merge the new serials into the sorted array instead of re-sorting everything
+        new_ids = np.arange(len(self.column.vocab), len(column.vocab), dtype=np.int32)
+        if len(new_ids):
+            new_ids = new_ids[np.argsort(column.vocab[new_ids], kind='stable')]
+            at = np.searchsorted(self.sorted_serials, column.vocab[new_ids], side='right')
+            clone.sorted_ids = np.insert(self.sorted_ids, at, new_ids)
+            clone.sorted_serials = column.vocab[clone.sorted_ids]
+        return clone
+
+    @staticmethod
+    def _split(serial):
+        match = SERIAL_PATTERN.match(serial)
+        if match is None or len(match.group(2)) > MAX_RANGE_DIGITS:
+            return None
+        return match.group(1), len(match.group(2)), int(match.group(2))
+
+    def _range_items(self, column, df, rows):
+        # (stem, width) -> [(low, high, row)] for the rows of `df`, at positions `rows`
+        if 'Đến serial' not in df.columns or df.empty:
+            return {}
+        starts = column.vocab[column.codes[rows]]
+        ends = df['Đến serial'].astype(object).where(df['Đến serial'].notna(), '').astype(str).str.strip()
+        ends = np.array([fold_text(value) for value in ends], dtype=object)
+
+        groups = {}
+        for i in np.flatnonzero((ends != '') & (ends != starts)):
+            start, end = self._split(starts[i]), self._split(ends[i])
+            # Only "same stem, same width, increasing number" pairs describe a range
+            if start is None or end is None or start[:2] != end[:2] or start[2] > end[2]:
+                continue
+            groups.setdefault(start[:2], []).append((start[2], end[2], int(rows[i])))
+        return groups
+
+    @staticmethod
+    def _merge_ranges(ranges, groups):
+        ranges = dict(ranges)
+        for key, items in groups.items():
+            if key in ranges:
+                items = items + list(zip(*(arr.tolist() for arr in ranges[key])))
+            items.sort()
+            lows, highs, rows = zip(*items)
+            ranges[key] = (np.array(lows, dtype=np.int64), np.array(highs, dtype=np.int64), np.array(rows, dtype=np.int64))
+        return ranges
+
+    def exact(self, serial):
+        """Rows listing exactly this serial (case-insensitive)."""
+        return self.column.rows(self.column.equal_ids(fold_text(serial.strip())))
+
+    def prefix(self, prefix):
+        """Rows whose serial starts with `prefix`."""
+        prefix = fold_text(prefix.strip())
+        if not prefix:
+            return EMPTY_POSITIONS
+        lo = np.searchsorted(self.sorted_serials, prefix, side='left')
+        hi = np.searchsorted(self.sorted_serials, prefix + '\U0010ffff', side='left')
+        return self.column.rows(self.sorted_ids[lo:hi])
+
+    def lookup(self, serials):
+        """
+        Batch form of exact + in_range for many scanned serials at once.
+        Returns (owner, rows): rows[i] is a row position matching serials[owner[i]].
+        """
+        folded = [fold_text(str(serial).strip()) for serial in serials]
+        vids = np.array([self.column.value_ids.get(serial, -1) for serial in folded], dtype=np.int64)
+        if len(vids):
+            # Serials cut off by the sheet are never exact hits, whatever their spelling
+            vids[[not serial for serial in folded]] = -1
+        found = np.flatnonzero(vids >= 0)
+
+        # Expand every matched value through the CSR layout in one go
+        starts = self.column.offsets[vids[found]]
+        counts = self.column.offsets[vids[found] + 1] - starts
+        owner = np.repeat(found, counts)
+        steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self.column.order[np.repeat(starts, counts) + steps]
+
+        # Serials nobody lists may still sit inside a 'Từ serial'..'Đến serial' range
+        owners, hits = [owner], [rows]
+        if self.ranges:
+            for i in np.flatnonzero(vids < 0):
+                in_range = self.in_range(folded[i])
+                owners.append(np.full(len(in_range), i, dtype=np.int64))
+                hits.append(in_range)
+        return np.concatenate(owners).astype(np.int64), np.concatenate(hits).astype(np.int64)
+
+    def in_range(self, serial):
+        """Rows whose 'Từ serial'..'Đến serial' range contains `serial`."""
+        parts = self._split(fold_text(serial.strip()))
+        if parts is None or parts[:2] not in self.ranges:
+            return EMPTY_POSITIONS
+        lows, highs, rows = self.ranges[parts[:2]]
+        # Ranges are sorted by their low end, only those starting at or before the serial can hold it
+        upto = np.searchsorted(lows, parts[2], side='right')
+        return np.sort(rows[:upto][highs[:upto] >= parts[2]])
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over the distinct (folded) values of one column.
+
+    Every value is stored once per word start, so a prefix is one binary search
+    for the range of matching keys; completions are then ranked by row count.
+    """
+
+    def __init__(self, column):
+        keys, vids = [], []
+        for vid, value in enumerate(column.vocab):
+            if not value:
+                continue
+            for start in dict.fromkeys([0] + [m.end() for m in WORD_BOUNDARY.finditer(value)]):
+                if start < len(value):
+                    keys.append(value[start:])
+                    vids.append(vid)
+        keys = np.array(keys, dtype=object)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.vids = np.array(vids, dtype=np.int64)[order]
+
+    def complete(self, prefix, counts, limit):
+        """Top `limit` (value id, count) completing `prefix` (folded), most frequent first."""
+        lo = np.searchsorted(self.keys, prefix, side='left')
+        hi = np.searchsorted(self.keys, prefix + '\U0010ffff', side='left')
+        at = np.arange(lo, hi)
+        weights = counts[self.vids[at]]
+        # A value can match through several of its words: over-fetch, then keep it once
+        # Ties (e.g. serials, one row each) are broken alphabetically, i.e. by key position
+        fetch = 4 * limit
+        if len(at) > fetch:
+            kth = np.partition(weights, len(weights) - fetch)[len(weights) - fetch]
+            above = np.flatnonzero(weights > kth)
+            tied = np.flatnonzero(weights == kth)[:fetch - len(above)]
+            top = np.concatenate([above, tied])
+            at, weights = at[top], weights[top]
+        order = np.lexsort((at, -weights))
+        vids = self.vids[at]
+        completions = {}
+        for vid, weight in zip(vids[order].tolist(), weights[order].tolist()):
+            if weight > 0:
+                completions.setdefault(vid, weight)
+            if len(completions) == limit:
+                break
+        return list(completions.items())
+
+
+class SearchIndex:
+    """Inverted trigram index over the searchable columns of one inventory frame.
+
+    All lookups return row positions (usable with df.iloc) in frame order.
+    """
+
+    def __init__(self, df, cache_size=256):
+        self.version = frame_version(df)
+        self.size = len(df)
+        self.columns = {col: ColumnIndex(df[col]) for col in SEARCH_COLUMNS if col in df.columns}
+        self.serials = SerialIndex(self.columns['Từ serial'], df) if 'Từ serial' in self.columns else None
+        self.haystack = self._build_haystack(np.arange(self.size))
+        # Built on the first suggest() call, under its own lock
+        self._prefixes = None
+        self._prefix_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def extended(self, df):
+        """Returns the index of `df`, a frame made of this index's rows plus appended ones.
+
+        Only the appended rows are folded, tokenized and added to the
+        haystack. This index stays valid for the previous dataset version.
+        """
+        tail = df.iloc[self.size:]
+        clone = copy.copy(self)
+        clone.version = frame_version(df)
+        clone.size = len(df)
+        clone.columns = {col: column.extended(tail[col]) for col, column in self.columns.items()}
+        if self.serials is not None:
+            clone.serials = self.serials.extended(clone.columns['Từ serial'], tail, self.size)
+        clone.haystack = pd.concat([self.haystack, clone._build_haystack(np.arange(self.size, clone.size))],
+                                   ignore_index=True)
+        clone._prefixes = None
+        clone._prefix_lock = threading.Lock()
+        clone._cache = OrderedDict()
+        clone._lock = threading.Lock()
+        return clone
+
+    def updated(self, df, old_rows):
+        """Returns the index of `df`, a refreshed version of this index's frame.
+
+        old_rows[i] is the row of the previous frame identical to row i of
+        `df`, or -1 for a new or changed row (see utils.changes). Vocabularies
+        are reused, and only the -1 rows are folded, tokenized and added to the
+        haystack. A column whose vocabulary became mostly stale is rebuilt.
+        """
+        clone = copy.copy(self)
+        clone.version = frame_version(df)
+        clone.size = len(df)
+        clone.columns, rebuilt = {}, set()
+        for col, column in self.columns.items():
+            column = column.reindexed(df[col])
+            if column.live_values() * 2 < len(column.vocab):
+                # Mostly values that are gone: start the vocabulary over
+                column = ColumnIndex(df[col])
+                rebuilt.add(col)
+            clone.columns[col] = column
+        if self.serials is not None:
+            serials = clone.columns['Từ serial']
+            if 'Từ serial' in rebuilt:
+                clone.serials = SerialIndex(serials, df)
+            else:
+                clone.serials = self.serials.updated(serials, df, old_rows)
+
+        haystack = np.empty(clone.size, dtype=object)
+        kept = np.flatnonzero(old_rows >= 0)
+        haystack[kept] = self.haystack.to_numpy(dtype=object)[old_rows[kept]]
+        changed = np.flatnonzero(old_rows < 0)
+        haystack[changed] = clone._build_haystack(changed).to_numpy(dtype=object)
+        clone.haystack = pd.Series(haystack, dtype=self.haystack.dtype)
+        clone._prefixes = None
+        clone._prefix_lock = threading.Lock()
+        clone._cache = OrderedDict()
+        clone._lock = threading.Lock()
+        return clone
+
+    def _build_haystack(self, rows):
+        # The vocabularies are already folded, spread them to `rows` through the codes
+        parts = []
+        for col in HAYSTACK_COLUMNS:
+            column = self.columns.get(col)
+            if column is not None:
+                parts.append(pd.Series(column.vocab[column.codes[rows]]))
+        if not parts:
+            return pd.Series([''] * len(rows))
+        return parts[0].str.cat(parts[1:], sep=HAYSTACK_SEPARATOR) if len(parts) > 1 else parts[0]
+
+    def _cached(self, key, compute):
+        # Streamlit serves every session from its own thread, guard the LRU bookkeeping
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        result = compute()
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def equals(self, col, text):
+        """Rows whose value in `col` equals `text` (case and accent-insensitive)."""
+        column = self.columns.get(col)
+        if column is None:
+            return EMPTY_POSITIONS
+        text = fold_text(text)
+        return self._cached(('eq', col, text), lambda: column.rows(column.equal_ids(text)))
+
+    def contains(self, col, fragment):
+        """Rows whose value in `col` contains `fragment` (case and accent-insensitive)."""
+        column = self.columns.get(col)
+        if column is None:
+            return EMPTY_POSITIONS
+        fragment = fold_text(fragment)
+        return self._cached(('in', col, fragment), lambda: column.rows(column.contain_ids(fragment)))
+
+    def serial_exact(self, serial):
+        """Rows listing exactly this serial."""
+        if self.serials is None:
+            return EMPTY_POSITIONS
+        return self.serials.exact(serial)
+
+    def serial_prefix(self, prefix):
+        """Rows whose serial starts with `prefix` (binary search, no scan)."""
+        if self.serials is None:
+            return EMPTY_POSITIONS
+        return self._cached(('prefix', fold_text(prefix.strip())), lambda: self.serials.prefix(prefix))
+
+    def serial_in_range(self, serial):
+        """Rows whose serial range covers `serial`."""
+        if self.serials is None:
+            return EMPTY_POSITIONS
+        return self.serials.in_range(serial)
+
+    def serial_lookup(self, serials):
+        """Batch exact/range serial lookup, see SerialIndex.lookup."""
+        if self.serials is None:
+            return EMPTY_POSITIONS, EMPTY_POSITIONS
+        return self.serials.lookup(serials)
+
+    def fuzzy(self, text, cols, limit=5, cutoff=FUZZY_SCORE_CUTOFF, allowed=None):
+        """Top `limit` values of `cols` closest to `text`, best first.
+
+        Runs on the distinct values only, pruned to the trigram-nearest
+        candidates before scoring. With an `allowed` row mask, only values
+        found on those rows are candidates (positions still cover every row).
+        Returns (col, label, score, positions) tuples.
+        """
+        text = fold_text(text.strip())
+        scope = mask_version(allowed)
+        return self._cached(('fuzzy', tuple(cols), text, limit, cutoff, scope),
+                            lambda: self._fuzzy(text, cols, limit, cutoff, allowed, scope))
+
+    def _fuzzy(self, text, cols, limit, cutoff, allowed, scope):
+        choices = {}
+        for col in cols:
+            column = self.columns.get(col)
+            if column is None:
+                continue
+            # Values without a (visible) row are never suggested
+            counts = self._cached(('counts', col, scope), lambda: self._value_counts(col, allowed))
+            for vid in column.similar_ids(text, FUZZY_CANDIDATES, counts > 0):
+                if column.vocab[vid]:
+                    choices[(col, int(vid))] = column.vocab[vid]
+        if not choices:
+            return []
+
+        best = process.extractBests(text, choices, scorer=fuzz.WRatio, score_cutoff=cutoff, limit=limit)
+        matches = []
+        for _, score, (col, vid) in best:
+            column = self.columns[col]
+            matches.append((col, column.labels[vid], score, column.rows([vid])))
+        return matches
+
+    def suggest(self, text, limit=SUGGEST_LIMIT, allowed=None):
+        """
+        Completions of `text` over the distinct values of SUGGEST_COLUMNS, most
+        frequent first. With an `allowed` row mask, values are counted on those
+        rows only and values outside it are never offered.
+        Returns (col, label, rows) tuples.
+        """
+        prefix = fold_text(text.strip())
+        if not prefix:
+            return []
+        prefixes = self._prefixes
+        if prefixes is None:
+            # Building takes a while on a large sheet: keep the query cache lock free meanwhile
+            with self._prefix_lock:
+                if self._prefixes is None:
+                    self._prefixes = {col: PrefixIndex(self.columns[col]) for col in SUGGEST_COLUMNS if col in self.columns}
+                prefixes = self._prefixes
+
+        scope = mask_version(allowed)
+        completions = []
+        for col, prefix_index in prefixes.items():
+            counts = self._cached(('counts', col, scope), lambda: self._value_counts(col, allowed))
+            labels = self.columns[col].labels
+            completions += [(col, labels[vid], count) for vid, count in prefix_index.complete(prefix, counts, limit)]
+        # Most frequent first across columns; the order of SUGGEST_COLUMNS breaks ties
+        completions.sort(key=lambda completion: -completion[2])
+        return completions[:limit]
+
+    def _value_counts(self, col, allowed):
+        column = self.columns[col]
+        if allowed is None:
+            return np.diff(column.offsets)
+        return np.bincount(column.codes[allowed], minlength=len(column.vocab))
+
+    def contains_any(self, cols, fragment):
+        """Rows where at least one of `cols` contains `fragment`."""
+        hits = [self.contains(col, fragment) for col in cols]
+        hits = [h for h in hits if len(h)]
+        if not hits:
+            return EMPTY_POSITIONS
+        return hits[0] if len(hits) == 1 else np.unique(np.concatenate(hits))
+
+    def match_all(self, tokens, stats=None):
+        """Boolean row mask: every token appears somewhere in the row (AND logic).
+
+        One vectorized pass per token over the folded haystack; each pass only
+        looks at the rows that survived the previous tokens. The number of rows
+        looked at is added to stats['rows_scanned'] when `stats` is given.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        tokens = sorted({fold_text(t) for t in tokens if t.strip()}, key=len, reverse=True)
+        if not tokens:
+            return mask
+
+        candidates = None
+        for token in tokens:
+            haystack = self.haystack if candidates is None else self.haystack.iloc[candidates]
+            if stats is not None:
+                stats['rows_scanned'] = stats.get('rows_scanned', 0) + len(haystack)
+            hits = haystack.str.contains(token, regex=False).to_numpy(dtype=bool)
+            candidates = np.flatnonzero(hits) if candidates is None else candidates[hits]
+            if not len(candidates):
+                return mask
+
+        mask[candidates] = True
+        return mask
+
+
+# Process-wide: one index per dataset version, shared by every session
+_INDEXES = OrderedDict()
+_MAX_INDEXES = 4
+# Indexes still held elsewhere (the current frame of a source or store) stay
+# reachable after they left the LRU, so they are never rebuilt
+_LIVE_INDEXES = weakref.WeakValueDictionary()
+_INDEXES_LOCK = threading.Lock()
+
+
+def _remember(index):
+    # Caller holds _INDEXES_LOCK
+    _INDEXES[index.version] = index
+    _INDEXES.move_to_end(index.version)
+    _LIVE_INDEXES[index.version] = index
+    if len(_INDEXES) > _MAX_INDEXES:
+        _INDEXES.popitem(last=False)
+
+
+def register_search_index(index):
+    """Publishes an index built elsewhere (e.g. extended after an append) for its version."""
+    with _INDEXES_LOCK:
+        _remember(index)
+
+
+def get_search_index(df):
+    """Returns the SearchIndex for this frame, building it once per dataset version."""
+    version = frame_version(df)
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(version) or _LIVE_INDEXES.get(version)
+        if index is None:
+            index = SearchIndex(df)
+        _remember(index)
+    return index
@@ -0,0 +1,423 @@
+"""
+Headless search service: one long-lived process holding the inventory frames and
+their search indexes, shared by every client over HTTP/JSON.
+
+    python -m utils.search_service --port 8765
+    python -m utils.search_service --source public=/path/to/export.csv
+
+Endpoints (`source` defaults to 'public'; 'all' is every sheet merged):
+
+    GET  /health?source=public             version, row count, last refresh error
+    GET  /search?q=...&limit=20&source=... search_positions() result + the first `limit` rows
+    GET  /suggest?q=...&limit=8&source=... search-as-you-type completions of a prefix
+    POST /lookup?source=...&rows=1         {"serials": [...]} -> rows of every serial, in one call
+                                           (rows=0: row positions only, for clients holding the frame)
+    GET  /frame?source=...                 the whole frame as an Arrow IPC stream (ETag = version)
+    GET  /changes?limit=100&source=...     latest movements found between refreshes, newest first
+
+The 'private' and 'all' sources are only served when TRO_LY_KHO_SERVICE_TOKEN
+is set, to requests carrying it in the X-Api-Key header. Requests are parsed on
+the event loop; searches run on a thread pool against the same frame and index.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import REFRESH_INTERVAL, SHEET_URLS, SOURCE_LABELS, InventorySource, InventoryStore, source_mask
+from utils.search_engine import search_positions, suggest_completions
+from utils.search_index import SUGGEST_LIMIT, frame_version, get_search_index, tag_frame
+from utils.snapshot import dump_frame
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_ROW_LIMIT = 20
+DEFAULT_CHANGE_LIMIT = 100
+# Serials accepted by one /lookup call
+MAX_BATCH = 10_000
+MAX_BODY_BYTES = 4 * 1024 * 1024
+PROTECTED_SOURCES = {'private', 'all'}
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class ServiceError(Exception):
+    """An error answered to the client with an HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def rows_to_records(df, rows, positions=None):
+    """Rows of `df` at `rows` as JSON-ready dicts, with their position (default `rows`) under '_position'."""
+    page = df.iloc[rows]
+    records = json.loads(page.to_json(orient='records', force_ascii=False, date_format='iso'))
+    for record, position in zip(records, rows if positions is None else positions):
+        record['_position'] = int(position)
+    return records
+
+
+class SourceView:
+    """
+    The rows of one sheet inside the merged frame. Clients only ever see the
+    view: its positions count its own rows, and its version is its own.
+    """
+
+    def __init__(self, df, source=None):
+        mask = None if source is None else source_mask(df, [source])
+        # A single sheet is the whole merged frame
+        self.mask = None if mask is None or mask.all() else mask
+        self.size = len(df) if self.mask is None else int(self.mask.sum())
+        self.merged_version = frame_version(df)
+        self.version = self.merged_version if self.mask is None else hashlib.blake2b(
+            f"{self.merged_version}|{source}".encode('utf-8'), digest_size=8).hexdigest()
+        # merged position -> view position
+        self._local = None if self.mask is None else np.cumsum(self.mask) - 1
+
+    def local(self, rows):
+        """View positions of merged-frame rows (all inside the view)."""
+        return rows if self._local is None else self._local[rows]
+
+    def frame(self, df):
+        """The view's rows as a frame of their own, holding only their own categories."""
+        if self.mask is None:
+            return df
+        view = df[self.mask].reset_index(drop=True)
+        for col in view.columns:
+            if isinstance(view[col].dtype, pd.CategoricalDtype):
+                view[col] = view[col].cat.remove_unused_categories()
+        return tag_frame(view, self.version)
+
+
+class SearchService:
+    """
+    The search API of one process, independent of any transport.
+
+    Every sheet is merged into one InventoryStore, so there is a single frame and
+    a single index; a sheet is served as a row-mask view of it, and 'all' (with
+    several sheets) is the whole merged frame.
+    """
+
+    def __init__(self, sources, refresh_interval=REFRESH_INTERVAL, api_key=None):
+        # Sheets are only read through the store, which indexes the merged frame itself
+        self.sheets = {name: InventorySource(url, refresh_interval, build_index=False) for name, url in sources.items()}
+        self.store = InventoryStore(dict(self.sheets))
+        self.sources = list(self.sheets) + (['all'] if len(self.sheets) > 1 else [])
+        self.api_key = api_key
+        self._views = {}
+        self._frames = {}
+        self._frames_lock = threading.Lock()
+
+    def view(self, source, api_key=None):
+        """(merged frame, SourceView of `source`), after the access check."""
+        if source not in self.sources:
+            raise ServiceError(404, f"Unknown source '{source}'")
+        if source in PROTECTED_SOURCES and not (
+            # compare_digest only takes ASCII str, and a latin-1 decoded header may be anything
+            self.api_key and api_key and hmac.compare_digest(self.api_key.encode('utf-8'), api_key.encode('utf-8'))
+        ):
+            raise ServiceError(403, f"Source '{source}' needs a valid X-Api-Key")
+        df = self.store.get()
+        version = frame_version(df)
+        with self._frames_lock:
+            view = self._views.get(source)
+            if view is None or view.merged_version != version:
+                view = self._views[source] = SourceView(df, None if source == 'all' else source)
+        return df, view
+
+    def health(self, source, api_key=None):
+        _, view = self.view(source, api_key)
+        state = self.store if source == 'all' else self.sheets[source]
+        return {
+            'source': source,
+            'version': view.version,
+            'rows': view.size,
+            'loaded_at': state.loaded_at,
+            'last_error': None if state.last_error is None else str(state.last_error),
+        }
+
+    def search(self, source, query, limit=DEFAULT_ROW_LIMIT, api_key=None):
+        """Same tiers and message as the chat UI, plus the first `limit` rows."""
+        df, view = self.view(source, api_key)
+        rows, message = search_positions(query, df, view.mask)
+        positions = view.local(rows)
+        return {
+            'source': source,
+            'version': view.version,
+            'query': query,
+            'message': message,
+            'total': len(positions),
+            'positions': positions.tolist(),
+            'rows': rows_to_records(df, rows[:limit], positions[:limit]) if limit > 0 else [],
+        }
+
+    def suggest(self, source, text, limit=SUGGEST_LIMIT, api_key=None):
+        """Completions of `text` over product names, codes, employees and serials."""
+        df, view = self.view(source, api_key)
+        return {
+            'source': source,
+            'version': view.version,
+            'completions': [{'column': col, 'value': str(value), 'rows': count}
+                            for col, value, count in suggest_completions(text, df, view.mask, limit)],
+        }
+
+    def lookup(self, source, serials, api_key=None, with_rows=True):
+        """
+        Resolves a batch of scanned serials (exact, or inside a serial range) in one pass.
+        Every result lists its row positions; `with_rows` adds the rows themselves.
+        """
+        if len(serials) > MAX_BATCH:
+            raise ServiceError(413, f"At most {MAX_BATCH} serials per call")
+        df, view = self.view(source, api_key)
+        owner, rows = get_search_index(df).serial_lookup(serials)
+        if view.mask is not None:
+            keep = view.mask[rows]
+            owner, rows = owner[keep], rows[keep]
+        positions = view.local(rows)
+
+        results = [{'serial': serial, 'positions': []} for serial in serials]
+        for i, position in zip(owner.tolist(), positions.tolist()):
+            results[i]['positions'].append(position)
+        if with_rows:
+            # One row materialization for the whole batch, then split per serial
+            for result in results:
+                result['rows'] = []
+            for i, record in zip(owner.tolist(), rows_to_records(df, rows, positions)):
+                results[i]['rows'].append(record)
+        found = np.zeros(len(serials), dtype=bool)
+        found[owner] = True
+        return {
+            'source': source,
+            'version': view.version,
+            'found': int(found.sum()),
+            'missing': [serial for serial, hit in zip(serials, found) if not hit],
+            'results': results,
+        }
+
+    def changes(self, source, limit=DEFAULT_CHANGE_LIMIT, api_key=None):
+        """The latest movements of `source` (see utils.changes), newest first."""
+        _, view = self.view(source, api_key)
+        labels = None if source == 'all' else [SOURCE_LABELS.get(source, source)]
+        events = self.store.changes.recent(limit, labels)
+        return {
+            'source': source,
+            'version': view.version,
+            'events': json.loads(events.to_json(orient='records', force_ascii=False, date_format='iso')),
+        }
+
+    def frame_bytes(self, source, api_key=None):
+        """(version, Arrow IPC bytes) of the view's frame, encoded once per version."""
+        df, view = self.view(source, api_key)
+        with self._frames_lock:
+            cached = self._frames.get(source)
+        if cached is None or cached[0] != view.version:
+            data = dump_frame(view.frame(df), {'source': source, 'digest': view.version})
+            with self._frames_lock:
+                cached = self._frames[source] = (view.version, data)
+        return cached
+
+    def warm_up(self):
+        """Loads every sheet (and builds the index) ahead of the first request."""
+        try:
+            self.store.get()
+        except Exception as e:
+            logger.warning("Could not load the sheets: %s", e)
+
+
+class _Response:
+    def __init__(self, status=200, body=b'', content_type='application/json', headers=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def _json_response(payload, status=200):
+    return _Response(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+
+def handle_request(service, method, target, headers, body):
+    """Routes one parsed HTTP request. Runs on a worker thread."""
+    url = urlsplit(target)
+    params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    source = params.get('source', 'public')
+    api_key = headers.get('x-api-key')
+
+    routes = {
+        '/health': ('GET', lambda: _json_response(service.health(source, api_key))),
+        '/search': ('GET', lambda: _search(service, source, params, api_key)),
+        '/suggest': ('GET', lambda: _suggest(service, source, params, api_key)),
+        '/lookup': ('POST', lambda: _lookup(service, source, params, body, api_key)),
+        '/frame': ('GET', lambda: _frame(service, source, headers, api_key)),
+        '/changes': ('GET', lambda: _changes(service, source, params, api_key)),
+    }
+    route = routes.get(url.path)
+    if route is None:
+        raise ServiceError(404, f"No endpoint {url.path}")
+    if method != route[0]:
+        raise ServiceError(405, f"{url.path} expects {route[0]}")
+    return route[1]()
+
+
+def _search(service, source, params, api_key):
+    query = params.get('q', '')
+    try:
+        limit = int(params.get('limit', DEFAULT_ROW_LIMIT))
+    except ValueError:
+        raise ServiceError(400, "limit must be an integer")
+    return _json_response(service.search(source, query, limit, api_key))
+
+
+def _suggest(service, source, params, api_key):
+    try:
+        limit = int(params.get('limit', SUGGEST_LIMIT))
+    except ValueError:
+        raise ServiceError(400, "limit must be an integer")
+    return _json_response(service.suggest(source, params.get('q', ''), limit, api_key))
+
+
+def _changes(service, source, params, api_key):
+    try:
+        limit = int(params.get('limit', DEFAULT_CHANGE_LIMIT))
+    except ValueError:
+        raise ServiceError(400, "limit must be an integer")
+    return _json_response(service.changes(source, limit, api_key))
+
+
+def _lookup(service, source, params, body, api_key):
+    try:
+        serials = json.loads(body or b'{}').get('serials')
+    except (ValueError, AttributeError):
+        raise ServiceError(400, "Body must be a JSON object")
+    if not isinstance(serials, list):
+        raise ServiceError(400, "Body must carry a 'serials' list")
+    with_rows = params.get('rows', '1') != '0'
+    return _json_response(service.lookup(source, [str(s) for s in serials], api_key, with_rows))
+
+
+def _frame(service, source, headers, api_key):
+    version, data = service.frame_bytes(source, api_key)
+    etag = f'"{version}"'
+    if headers.get('if-none-match') == etag:
+        return _Response(304, headers={'ETag': etag})
+    return _Response(200, data, 'application/vnd.apache.arrow.stream', {'ETag': etag})
+
+
+async def _read_request(reader):
+    """Returns (method, target, headers, body), or None when the client closed the connection."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise ServiceError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise ServiceError(400, "Invalid Content-Length")
+    if length < 0:
+        raise ServiceError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise ServiceError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+async def _write_response(writer, response, keep_alive):
+    head = [f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, '')}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{name}: {value}" for name, value in response.headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + response.body)
+    await writer.drain()
+
+
+async def _serve_connection(service, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                response = await loop.run_in_executor(None, handle_request, service, method, target, headers, body)
+            except ServiceError as e:
+                keep_alive = False
+                response = _json_response({'error': str(e)}, e.status)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                logger.exception("Request failed")
+                keep_alive = False
+                response = _json_response({'error': str(e)}, 500)
+            await _write_response(writer, response, keep_alive)
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Runs the HTTP server until cancelled."""
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(lambda r, w: _serve_connection(service, r, w), host, port)
+    logger.info("Search service listening on %s:%s", host, port)
+    loop.run_in_executor(None, service.warm_up)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--source', action='append', metavar='NAME=URL',
+                        help="sheet export (URL or local CSV) served as NAME; defaults to the app's sheets")
+    parser.add_argument('--refresh-interval', type=int, default=REFRESH_INTERVAL)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # Streamlit warns about the missing script context in bare mode
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+    sources = dict(SHEET_URLS)
+    if args.source:
+        sources = dict(item.split('=', 1) for item in args.source)
+    api_key = os.environ.get('TRO_LY_KHO_SERVICE_TOKEN')
+    if not api_key:
+        sources = {name: url for name, url in sources.items() if name not in PROTECTED_SOURCES}
+
+    service = SearchService(sources, args.refresh_interval, api_key)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.changes import EVENT_COLUMNS
+from utils.reconcile import index_lookup
+from utils.search_engine import search_positions, suggest_completions
+from utils.search_index import SUGGEST_LIMIT, frame_version, tag_frame
+from utils.snapshot import read_frame
+
+# When set, the Streamlit app reads and searches through this search service (see utils.search_service)
+SERVICE_URL = os.environ.get('TRO_LY_KHO_SERVICE_URL')
+SERVICE_TIMEOUT = 30
+# Serials per /lookup call (the service's MAX_BATCH)
+LOOKUP_BATCH = 10_000
+
+
+class ServiceClient:
+    """
+    Client of one source of the search service.
+    Mirrors load_data / search_positions, so the app works the same either way.
+    """
+
+    def __init__(self, base_url, source, api_key=None):
+        self.base_url = base_url.rstrip('/')
+        self.source = source
+        self.api_key = api_key
+        self.df = None
+        self._lock = threading.Lock()
+
+    def _request(self, path, params=None, body=None, headers=None):
+        query = urlencode({'source': self.source, **(params or {})})
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(f"{self.base_url}{path}?{query}", data=data, headers=headers or {})
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        if self.api_key:
+            request.add_header('X-Api-Key', self.api_key)
+        return urllib.request.urlopen(request, timeout=SERVICE_TIMEOUT)
+
+    def _json(self, path, params=None, body=None):
+        with self._request(path, params, body) as response:
+            return json.loads(response.read())
+
+    def health(self):
+        return self._json('/health')
+
+    def load_data(self):
+        """Same as data_loader.load_data, for the service's frame."""
+        try:
+            return self.frame()
+        except Exception as e:
+            st.error(f"Lỗi khi tải dữ liệu từ dịch vụ tìm kiếm: {e}")
+            return pd.DataFrame()
+
+    def frame(self):
+        """The service's current frame; only downloaded again when its version changed."""
+        with self._lock:
+            headers = {'If-None-Match': f'"{frame_version(self.df)}"'} if self.df is not None else {}
+            try:
+                with self._request('/frame', headers=headers) as response:
+                    df, meta = read_frame(response.read())
+            except HTTPError as e:
+                if e.code == 304:
+                    return self.df
+                raise
+            tag_frame(df, meta['digest'])
+            self.df = df
+            return df
+
+    def search_positions(self, query, df, allowed=None):
+        """
+        Same contract as search_engine.search_positions, answered by the service.
+        The service already scopes the frame to this client's source: `allowed` is not sent.
+        """
+        if allowed is not None:
+            return search_positions(query, df, allowed)
+        result = self._json('/search', {'q': query, 'limit': 0})
+        if result['version'] != frame_version(df):
+            # The service refreshed after `df` was fetched: its positions would not line up
+            return search_positions(query, df)
+        return np.asarray(result['positions'], dtype=np.int64), result['message']
+
+    def suggest_completions(self, text, df, allowed=None, limit=SUGGEST_LIMIT):
+        """Same contract as search_engine.suggest_completions, answered by the service."""
+        if allowed is not None or not text.strip():
+            return suggest_completions(text, df, allowed, limit)
+        result = self._json('/suggest', {'q': text, 'limit': limit})
+        return [(c['column'], c['value'], c['rows']) for c in result['completions']]
+
+    def recent_movements(self, limit=None):
+        """Same as data_loader.recent_movements, for this client's source."""
+        events = self._json('/changes', {'limit': limit or 0})['events']
+        events = pd.DataFrame(events, columns=EVENT_COLUMNS)
+        events['Thời điểm'] = pd.to_datetime(events['Thời điểm'])
+        return events
+
+    def lookup(self, serials, rows=True):
+        """Batch serial lookup, see SearchService.lookup."""
+        return self._json('/lookup', {'rows': int(rows)}, {'serials': list(serials)})
+
+    def serial_lookup(self, serials, df):
+        """Same contract as reconcile.index_lookup, answered by the service."""
+        owner, positions = [], []
+        for start in range(0, len(serials), LOOKUP_BATCH):
+            result = self.lookup(serials[start:start + LOOKUP_BATCH], rows=False)
+            if result['version'] != frame_version(df):
+                # The service refreshed after `df` was fetched: its positions would not line up
+                return index_lookup(serials, df)
+            for i, item in enumerate(result['results'], start=start):
+                owner.extend([i] * len(item['positions']))
+                positions.extend(item['positions'])
+        return np.asarray(owner, dtype=np.int64), np.asarray(positions, dtype=np.int64)
+
+
+@st.cache_resource
+def get_service_client(base_url, source):
+    """One client (and one copy of the frame) per source for the whole Streamlit process."""
+    return ServiceClient(base_url, source, os.environ.get('TRO_LY_KHO_SERVICE_TOKEN'))
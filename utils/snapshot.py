@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # Snapshots are an optimization, the app works without them
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = Path(os.environ.get('TRO_LY_KHO_SNAPSHOT_DIR', Path(__file__).resolve().parent.parent / '.cache'))
+# Object columns with fewer distinct values than this share of rows are stored dictionary-encoded
+DICTIONARY_RATIO = 0.5
+META_KEY = b'tro_ly_kho'
+
+
+def snapshot_path(url):
+    """Local snapshot file of one sheet URL."""
+    return SNAPSHOT_DIR / f"{hashlib.blake2b(url.encode('utf-8'), digest_size=8).hexdigest()}.arrow"
+
+
+def _json_default(value):
+    # numpy scalars coming out of the ffill state
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _to_table(df, meta):
+    # Repeated text columns (product, employee, district...) are dictionary-encoded
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            # Arrow needs one type per column: keep numbers typed in the sheet as text
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        if pd.api.types.is_string_dtype(df[col]) and df[col].nunique() < len(df) * DICTIONARY_RATIO:
+            df[col] = df[col].astype('category')
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata[META_KEY] = json.dumps(meta, default=_json_default).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+
+def _from_table(table):
+    meta = json.loads(table.schema.metadata[META_KEY])
+    return table.to_pandas(types_mapper=_arrow_strings), meta
+
+
+def save_snapshot(path, df, meta):
+    """
+    Writes the cleaned frame as an uncompressed Arrow IPC file, atomically.
+    Repeated text columns (product, employee, district...) are dictionary-encoded.
+    """
+    if pa is None:
+        return False
+
+    table = _to_table(df, meta)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Other processes may have the old file mapped: write aside, then swap the name
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+def _arrow_strings(arrow_type):
+    # Plain string columns stay Arrow-backed, in the dtype of freshly loaded serials (data_loader.SERIAL_DTYPE)
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype('pyarrow')
+    return None
+
+
+def load_snapshot(path):
+    """
+    Memory-maps a snapshot written by save_snapshot.
+    Returns (df, meta), or None when there is no usable snapshot.
+    """
+    if pa is None or not Path(path).exists():
+        return None
+    try:
+        source = pa.memory_map(str(path), 'r')
+        return _from_table(pa.ipc.open_file(source).read_all())
+    except Exception as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        return None
+
+
+def dump_frame(df, meta):
+    """The snapshot encoding of `df` as bytes (an Arrow IPC stream), to send over the wire."""
+    if pa is None:
+        raise RuntimeError("pyarrow is required to transfer frames")
+    table = _to_table(df, meta)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def read_frame(data):
+    """Inverse of dump_frame, returns (df, meta)."""
+    if pa is None:
+        raise RuntimeError("pyarrow is required to transfer frames")
+    return _from_table(pa.ipc.open_stream(pa.py_buffer(data)).read_all())
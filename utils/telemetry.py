@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Records kept in memory for the admin panel
+RING_BUFFER_SIZE = 2000
+
+
+class RingBufferSink:
+    """Keeps the last `maxlen` trace records in memory."""
+
+    def __init__(self, maxlen=RING_BUFFER_SIZE):
+        self._records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self, kind=None):
+        with self._lock:
+            records = list(self._records)
+        return records if kind is None else [r for r in records if r['kind'] == kind]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+class JsonLinesSink:
+    """Appends every trace record as one JSON line to `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+RECENT = RingBufferSink()
+_SINKS = [RECENT]
+if os.environ.get('TRO_LY_KHO_TRACE_FILE'):
+    _SINKS.append(JsonLinesSink(os.environ['TRO_LY_KHO_TRACE_FILE']))
+
+
+def add_sink(sink):
+    """Registers an extra sink (any object with a write(record) method)."""
+    _SINKS.append(sink)
+
+
+def remove_sink(sink):
+    _SINKS.remove(sink)
+
+
+def emit(record):
+    """Sends one trace record to every sink. A failing sink never breaks a query."""
+    record.setdefault('ts', time.time())
+    for sink in list(_SINKS):
+        try:
+            sink.write(record)
+        except Exception:
+            pass
+
+
+class QueryTrace:
+    """Collects per-tier timings of one search_inventory call."""
+
+    def __init__(self, query, version):
+        self.query = query
+        self.version = version
+        self.tiers = []
+        self.answered_by = None
+        self._start = time.perf_counter()
+
+    def run(self, tier, lookup, stats=None):
+        """
+        Times one tier. `lookup` returns the tier's matches; `stats` is an
+        optional dict the lookup fills with 'rows_scanned'.
+        """
+        start = time.perf_counter()
+        result = lookup()
+        candidates = len(result)
+        self.tiers.append({
+            'tier': tier,
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+            'rows_scanned': (stats or {}).get('rows_scanned', candidates),
+            'candidates': candidates,
+        })
+        if candidates:
+            self.answered_by = tier
+        return result
+
+    def finish(self, cache, results, answered_by=None):
+        emit({
+            'kind': 'query',
+            'query': self.query,
+            'version': self.version,
+            'cache': cache,
+            'answered_by': answered_by or self.answered_by,
+            'results': int(results),
+            'total_ms': round((time.perf_counter() - self._start) * 1000, 3),
+            'tiers': self.tiers,
+        })
+
+
+class LoadTrace:
+    """Collects the step timings of one data load/refresh."""
+
+    def __init__(self, url):
+        self.url = url
+        self.steps = {}
+        self._start = time.perf_counter()
+
+    def step(self, name):
+        return _Step(self.steps, name)
+
+    def finish(self, mode, rows=None):
+        emit({
+            'kind': 'load',
+            'url': self.url,
+            'mode': mode,
+            'rows': rows,
+            'total_ms': round((time.perf_counter() - self._start) * 1000, 3),
+            **{f"{name}_ms": ms for name, ms in self.steps.items()},
+        })
+
+
+class _Step:
+    def __init__(self, steps, name):
+        self.steps = steps
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.steps[self.name] = round(self.steps.get(self.name, 0) + (time.perf_counter() - self._start) * 1000, 3)
+        return False
+
+
+class timed:
+    """Context manager emitting one record of `kind` with the elapsed 'ms' and `fields`."""
+
+    def __init__(self, kind, **fields):
+        self.record = {'kind': kind, **fields}
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        self.record['ms'] = round((time.perf_counter() - self._start) * 1000, 3)
+        emit(self.record)
+        return False
+
+
+def percentiles(values):
+    """p50/p95/p99 of a list of milliseconds."""
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2)}
+
+
+def summarize_queries(records):
+    """Aggregate percentiles per tier, plus the total, over query trace records."""
+    by_tier = {}
+    for record in records:
+        by_tier.setdefault('(tổng)', []).append(record['total_ms'])
+        for tier in record['tiers']:
+            by_tier.setdefault(tier['tier'], []).append(tier['ms'])
+    return [{'tier': tier, 'count': len(values), **percentiles(values)} for tier, values in by_tier.items()]
+
+
+def slowest_queries(records, limit=10):
+    """The `limit` slowest query records, slowest first."""
+    return sorted(records, key=lambda r: r['total_ms'], reverse=True)[:limit]
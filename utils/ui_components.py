@@ -1,5 +1,14 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
+from utils.changes import EVENT_ADDED, EVENT_REMOVED, MOVEMENT_EVENTS
+from utils.reconcile import STATUS_MISSING, STATUS_OTHER_DISTRICT, STATUS_OTHER_HOLDER, parse_serials, read_scan_file, reconcile_serials, report_csv, summarize_report
+from utils.search_engine import get_query_cache_stats
+from utils.search_index import frame_version, mask_version, match_rows
+from utils.telemetry import RECENT, percentiles, slowest_queries, summarize_queries
+
+# Rows sent to the browser per results page
+PAGE_SIZE = 50
 
 def inject_custom_css():
     """Injects the Enterprise-grade CSS into the Streamlit app."""
@@ -166,6 +175,7 @@ def render_asset_card(row):
     holder = row.get('NHÂN VIÊN NHẬN', 'Chưa bàn giao')
     location = row.get('QUẬN/HUYỆN', 'Không xác định')
     warehouse = row.get('LOẠI KHO', '')
+    source = row.get('Nguồn', '')
 
     badge_class = get_status_badge(status)
 
@@ -175,7 +185,7 @@ def render_asset_card(row):
         <div class="asset-header">
             <div>
                 <h3 class="asset-title">\U0001F4E6 {name}</h3>
-                <div class="asset-id">SN: {serial} • ID: {code}</div>
+                <div class="asset-id">SN: {serial} • ID: {code}{f" • {source}" if source else ""}</div>
             </div>
             <span class="asset-badge {badge_class}">{status}</span>
         </div>
@@ -193,8 +203,31 @@ def render_asset_card(row):
     """
     st.markdown(html, unsafe_allow_html=True)
 
-def render_results_table(df):
-    """Renders the data table with improved column config."""
+def _sort_positions(df, positions, col, ascending):
+    """Orders row positions by one column, without copying the rows."""
+    values = df[col].iloc[positions].reset_index(drop=True)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Categories appended on refresh are not in alphabetical order
+        values = values.cat.set_categories(sorted(values.cat.categories, key=str), ordered=True)
+    order = values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    return positions[order]
+
+def shown_frame(df):
+    """
+    `df` with every categorical column cut down to the categories its rows use.
+    Streamlit serializes the whole category list of a column, which for the
+    merged store also holds the values of sheets this user cannot see.
+    """
+    categorical = {col: df[col].cat.remove_unused_categories()
+                   for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    return df.assign(**categorical) if categorical else df
+
+def render_results_table(df, positions=None, key="results"):
+    """
+    Renders the data table with improved column config.
+    With `positions`, `df` is the whole inventory: filtering, sorting and paging
+    run server-side on the row positions and only the visible page is sent.
+    """
     # Columns to specifically look for and configure
     # Map friendly names
     column_config = {
@@ -206,6 +239,7 @@ def render_results_table(df):
         "QUẬN/HUYỆN": st.column_config.TextColumn("\U0001F4CD Khu Vực"),
         "Mã hàng hóa": st.column_config.TextColumn("\U0001F516 Mã BH"),
         "Số lượng": st.column_config.NumberColumn("\U0001F4CA SL"),
+        "Nguồn": st.column_config.TextColumn("\U0001F3EC Kho"),
     }
     
     # Filter for columns that actually exist in this DF
@@ -214,7 +248,7 @@ def render_results_table(df):
     ]]
     
     # Priority columns first
-    priority_order = ['Tên hàng hóa', 'Từ serial', 'Trạng thái', 'Trạng Thái Chuẩn', 'NHÂN VIÊN NHẬN', 'QUẬN/HUYỆN', 'Số lượng']
+    priority_order = ['Tên hàng hóa', 'Từ serial', 'Trạng thái', 'Trạng Thái Chuẩn', 'NHÂN VIÊN NHẬN', 'QUẬN/HUYỆN', 'Nguồn', 'Số lượng']
     # Sort existing columns based on priority
     final_cols = sorted(existing_cols, key=lambda x: priority_order.index(x) if x in priority_order else 999)
 
@@ -222,35 +256,228 @@ def render_results_table(df):
     if 'Trạng thái' in final_cols and 'Trạng Thái Chuẩn' in final_cols:
         final_cols.remove('Trạng Thái Chuẩn')
 
+    total = len(df) if positions is None else len(positions)
+    if total > PAGE_SIZE:
+        if positions is None:
+            positions = np.arange(len(df))
+
+        col_filter, col_sort, col_order = st.columns([3, 2, 1])
+        with col_filter:
+            keyword = st.text_input("🔎 Lọc trong kết quả", key=f"{key}_filter", placeholder="vd: hỏng, Gò Vấp...")
+        with col_sort:
+            sort_col = st.selectbox("Sắp xếp theo", ["(Mặc định)"] + final_cols, key=f"{key}_sort")
+        with col_order:
+            descending = st.toggle("Giảm dần", key=f"{key}_desc")
+
+        if keyword.strip():
+            # Same accent-insensitive AND matching as the combined search, folding these rows only
+            positions = positions[match_rows(df, positions, keyword.split())]
+        if sort_col != "(Mặc định)" and len(positions):
+            positions = _sort_positions(df, positions, sort_col, not descending)
+
+        pages = max(1, -(-len(positions) // PAGE_SIZE))
+        if st.session_state.get(f"{key}_page", 1) > pages:
+            # The filter shrank the result: stay on the last page that still exists
+            st.session_state[f"{key}_page"] = pages
+        page = st.number_input("Trang", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page") if pages > 1 else 1
+        start = (page - 1) * PAGE_SIZE
+        st.caption(f"Hiển thị {min(start + 1, len(positions)):,}–{min(start + PAGE_SIZE, len(positions)):,} / {len(positions):,} kết quả")
+        page_df = df.iloc[positions[start:start + PAGE_SIZE]]
+    else:
+        page_df = df if positions is None else df.iloc[positions]
+
     st.dataframe(
-        df[final_cols],
+        shown_frame(page_df[final_cols]),
         column_config=column_config,
         hide_index=True,
         use_container_width=True
     )
 
-def render_sidebar_stats(df):
-    """Calculates and displays simple stats in the sidebar."""
+# Display names of the get_status_badge classes
+STATUS_CLASS_LABELS = {
+    'badge-success': '✅ Tốt / Mới',
+    'badge-warning': '🛠️ Bảo hành / Sửa',
+    'badge-danger': '❌ Hỏng / Lỗi',
+    'badge-neutral': '❔ Khác',
+}
+# Rows shown per breakdown in the sidebar panel
+TOP_GROUPS = 10
+
+def classify_status(status):
+    """Status class of every row (same rules as get_status_badge), as a categorical."""
+    if not isinstance(status.dtype, pd.CategoricalDtype):
+        status = status.astype('category')
+    # One get_status_badge call per distinct status, then spread through the codes
+    classes = np.array([get_status_badge(c) for c in status.cat.categories] + [get_status_badge(None)], dtype=object)
+    codes = status.cat.codes.to_numpy()
+    return pd.Categorical(classes[np.where(codes < 0, len(classes) - 1, codes)], categories=list(STATUS_CLASS_LABELS))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def compute_inventory_stats(_df, version, _allowed=None, scope=None):
+    """Aggregates for the sidebar panel, computed once per dataset version and row mask."""
+    df = _df if _allowed is None else _df[_allowed]
+    stats = {'total': len(df)}
+
+    status_col = 'Trạng thái' if 'Trạng thái' in df.columns else 'Trạng Thái Chuẩn'
+    if status_col in df.columns:
+        counts = pd.Series(classify_status(df[status_col])).value_counts(sort=False)
+        stats['status'] = counts.rename(index=STATUS_CLASS_LABELS)
+
+    for key, col in [('source', 'Nguồn'), ('district', 'QUẬN/HUYỆN'), ('warehouse', 'LOẠI KHO'), ('holder', 'NHÂN VIÊN NHẬN')]:
+        if col in df.columns:
+            counts = df[col].value_counts()
+            # Categories of the other sheet are listed with a zero count, and stay in a categorical index
+            counts = counts[counts > 0].head(TOP_GROUPS)
+            stats[key] = counts.set_axis(counts.index.astype(object))
+    return stats
+
+def render_sidebar_stats(df, allowed=None):
+    """Displays the cached inventory stats (of the `allowed` rows) in the sidebar."""
     if df.empty:
         return
 
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 📊 Thống kê nhanh")
-    
-    total_items = len(df)
-    
-    # Try to calculate 'Available' vs 'In Use'
-    # This is rough logic based on typical column values
-    status_col = 'Trạng thái' if 'Trạng thái' in df.columns else 'Trạng Thái Chuẩn'
-    
+
+    stats = compute_inventory_stats(df, frame_version(df), allowed, mask_version(allowed))
+
     col1, col2 = st.sidebar.columns(2)
     with col1:
-        st.metric("Tổng số", f"{total_items:,}")
-    
-    if status_col in df.columns:
-        # Count 'Mới' or similar
-        good_items = df[df[status_col].astype(str).str.lower().str.contains('mới|new|tốt', na=False)]
+        st.metric("Tổng số", f"{stats['total']:,}")
+
+    if 'status' in stats:
         with col2:
-            st.metric("Hàng tốt", f"{len(good_items):,}")
-    
+            st.metric("Hàng tốt", f"{int(stats['status'].get(STATUS_CLASS_LABELS['badge-success'], 0)):,}")
+
+    with st.sidebar.expander("📈 Phân bổ chi tiết"):
+        for key, title in [('status', 'Theo trạng thái'), ('source', 'Theo nguồn kho'), ('district', 'Theo quận/huyện'),
+                           ('warehouse', 'Theo loại kho'), ('holder', 'Theo người giữ')]:
+            if key in stats:
+                st.caption(title)
+                st.dataframe(stats[key].rename("Số lượng"), use_container_width=True)
+
     st.sidebar.markdown("---")
+
+# Icon of each suggestion column, same as the results table headers
+SUGGESTION_ICONS = {'Tên hàng hóa': "\U0001F4E6", 'Mã hàng hóa': "\U0001F516", 'NHÂN VIÊN NHẬN': "\U0001F464", 'Từ serial': "\U0001F522"}
+
+def render_suggestions(df, suggest, allowed=None):
+    """
+    Sidebar search-as-you-type box: completions of what was typed so far.
+    Returns the picked value (to run as a query), or None.
+    """
+    with st.sidebar:
+        text = st.text_input("⚡ Gợi ý tìm kiếm", key="suggest_text", placeholder="Gõ vài ký tự: cam, 215, vo minh...")
+        if not text.strip():
+            return None
+        completions = suggest(text, df, allowed)
+        if not completions:
+            st.caption("Không có gợi ý phù hợp.")
+            return None
+        picked = None
+        for i, (col, value, count) in enumerate(completions):
+            if st.button(f"{SUGGESTION_ICONS.get(col, '')} {value} · {count:,}", key=f"suggest_{i}", use_container_width=True):
+                picked = str(value)
+        return picked
+
+def render_monitoring_panel():
+    """Admin view of the recent query/load traces (utils.telemetry)."""
+    with st.sidebar.expander("🛠️ Giám sát truy vấn"):
+        cache = get_query_cache_stats()
+        col1, col2 = st.columns(2)
+        col1.metric("Cache hit", f"{cache['hit_rate']:.0%}")
+        col2.metric("Mục trong cache", f"{cache['entries']:,}")
+
+        queries = RECENT.records('query')
+        if not queries:
+            st.caption("Chưa có truy vấn nào được ghi nhận.")
+        else:
+            st.caption(f"Thời gian theo tầng tìm kiếm ({len(queries):,} truy vấn gần nhất)")
+            st.dataframe(pd.DataFrame(summarize_queries(queries)), hide_index=True, use_container_width=True)
+
+            st.caption("Truy vấn chậm nhất")
+            slowest = pd.DataFrame(slowest_queries(queries))[['query', 'total_ms', 'answered_by', 'cache', 'results']]
+            st.dataframe(slowest, hide_index=True, use_container_width=True)
+
+        renders = [r['ms'] for r in RECENT.records('render')]
+        if renders:
+            st.caption(f"Hiển thị kết quả: p95 {percentiles(renders)['p95_ms']} ms")
+
+        loads = RECENT.records('load')
+        if loads:
+            st.caption("Lần tải dữ liệu gần nhất")
+            st.dataframe(pd.DataFrame(loads[-5:]).drop(columns=['kind', 'url', 'ts']), hide_index=True, use_container_width=True)
+
+def _choices(df, col, allowed=None):
+    if col not in df.columns:
+        return ["(Không kiểm tra)"]
+    values = df[col] if allowed is None else df[col][allowed]
+    return ["(Không kiểm tra)"] + sorted(values.dropna().astype(str).unique().tolist())
+
+def render_reconciliation(df, allowed=None, lookup=None):
+    """
+    Bulk stock-take mode: resolves a whole scan list at once and offers the report.
+    `lookup` replaces the local batch serial lookup (see reconcile_serials).
+    """
+    st.markdown("### 📋 Đối soát serial hàng loạt")
+    st.caption("Dán danh sách serial đã quét (mỗi dòng một serial) hoặc tải lên file CSV/TXT.")
+
+    col_paste, col_upload = st.columns(2)
+    with col_paste:
+        pasted = st.text_area("Danh sách serial", height=200, key="reconcile_text", placeholder="215000123\n215000124\n...")
+    with col_upload:
+        uploaded = st.file_uploader("File quét", type=["csv", "txt"], key="reconcile_file")
+        holder = st.selectbox("Người giữ cần kiểm", _choices(df, 'NHÂN VIÊN NHẬN', allowed), key="reconcile_holder")
+        district = st.selectbox("Khu vực cần kiểm", _choices(df, 'QUẬN/HUYỆN', allowed), key="reconcile_district")
+
+    serials = parse_serials(pasted)
+    if uploaded is not None:
+        serials = list(dict.fromkeys(serials + read_scan_file(uploaded.name, uploaded.getvalue())))
+    if not serials:
+        return
+
+    report = reconcile_serials(
+        serials, df,
+        holder=None if holder == "(Không kiểm tra)" else holder,
+        district=None if district == "(Không kiểm tra)" else district,
+        allowed=allowed,
+        lookup=lookup,
+    )
+    summary = summarize_report(report)
+
+    cols = st.columns(5)
+    cols[0].metric("Đã quét", f"{summary['scanned']:,}")
+    cols[1].metric("Tìm thấy", f"{summary['found']:,}")
+    cols[2].metric("Không tìm thấy", f"{summary['missing']:,}")
+    cols[3].metric("Khác người giữ", f"{summary['other_holder']:,}")
+    cols[4].metric("Khác khu vực", f"{summary['other_district']:,}")
+
+    st.download_button("⬇️ Tải báo cáo đối soát (CSV)", report_csv(report), file_name="doi_soat_serial.csv", mime="text/csv")
+
+    tabs = st.tabs(["Tất cả", "Không tìm thấy", "Khác người giữ", "Khác khu vực"])
+    for tab, status in zip(tabs, [None, STATUS_MISSING, STATUS_OTHER_HOLDER, STATUS_OTHER_DISTRICT]):
+        with tab:
+            rows = report if status is None else report[report['Kết quả'] == status]
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+
+def render_movements(events):
+    """Recent movements mode: what changed between two data refreshes (utils.changes)."""
+    st.markdown("### 🔄 Biến động gần đây")
+    st.caption("Thay đổi phát hiện giữa các lần đồng bộ dữ liệu: nhập mới, rời kho, đổi người giữ, đổi trạng thái, chuyển kho.")
+    if events.empty:
+        st.info("Chưa ghi nhận biến động nào kể từ khi ứng dụng khởi động.")
+        return
+
+    counts = events['Sự kiện'].value_counts()
+    cols = st.columns(4)
+    cols[0].metric("Nhập mới", f"{counts.get(EVENT_ADDED, 0):,}")
+    cols[1].metric("Rời kho", f"{counts.get(EVENT_REMOVED, 0):,}")
+    cols[2].metric("Đổi người giữ", f"{counts.get(MOVEMENT_EVENTS['NHÂN VIÊN NHẬN'], 0):,}")
+    cols[3].metric("Đổi trạng thái", f"{counts.get(MOVEMENT_EVENTS['Trạng thái'], 0):,}")
+
+    kinds = st.multiselect("Loại biến động", list(counts.index), default=list(counts.index), key="movement_kinds")
+    rows = events[events['Sự kiện'].isin(kinds)]
+    if rows['Nguồn'].isna().all():
+        rows = rows.drop(columns='Nguồn')
+    st.download_button("⬇️ Tải nhật ký biến động (CSV)", report_csv(rows), file_name="bien_dong_kho.csv", mime="text/csv")
+    st.dataframe(rows, hide_index=True, use_container_width=True)